@@ -1,30 +1,68 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from authlib.integrations.flask_client import OAuth
-from datetime import datetime, date
-from decimal import Decimal
+from datetime import datetime, date, timedelta
+from decimal import Decimal, InvalidOperation
 import os
 import secrets
 from dotenv import load_dotenv
 import os
 
-from sqlalchemy import func, desc, or_, and_
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import func, desc, or_, and_, case, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Load, joinedload, selectinload
 from models import (
     db, User, UserRole, AcademicYear, Class, Stream, Vehicle, Student, StudentType,
     FeeItem, FeeRate, FeeScope, StudentFeeAssignment, FeeAssessment, Payment,
     PaymentMode, PaymentAllocation, StudentPromotion, PromotionStatus,
-    ExpenseCategory, Expense, generate_fee_assessments, get_student_balance_summary
+    ExpenseCategory, Expense, generate_fee_assessments, get_student_balance_summary,
+    get_active_vehicles, get_all_classes, get_current_academic_year, get_dashboard_stats,
+    get_stream_options, next_receipt_sequence
 )
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to Flask's stdlib encoder
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider encoding with orjson while keeping Flask's output format"""
+
+    def dumps(self, obj, **kwargs):
+        # Dates, Decimals and sort order go through the same rules as the default provider
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Dynamically find and load the .env file from current project directory
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
 
 # Initialize Flask app
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(16))
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///school_fees.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    # Room for every distinct statement the routes build; SQLAlchemy's default is 500
+    'query_cache_size': 1200,
+}
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # SQLite pooling is managed by the driver; size the pool for server databases only
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+    })
 
 # Google OAuth configuration
 app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
@@ -109,6 +147,80 @@ def load_user(user_id):
     return User.query.get(int(user_id))
 
 
+# ===========================
+#  FORM PARSING
+# ===========================
+def parse_decimal(value):
+    """Decimal from form text, raising ValueError like int() does"""
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"'{value}' is not a valid amount")
+
+
+def optional_field(form, name, convert):
+    """Converted form value, or None when the field is missing or blank"""
+    value = form.get(name)
+    return convert(value) if value else None
+
+
+def student_form_values(form):
+    """Student column values from a submitted add/edit student form"""
+    return {
+        'admission_no': form['admission_no'],
+        'first_name': form['first_name'],
+        'last_name': form['last_name'],
+        'date_of_birth': optional_field(form, 'date_of_birth', date.fromisoformat),
+        'class_id': int(form['class_id']),
+        'stream_id': optional_field(form, 'stream_id', int),
+        'student_type': StudentType(form['student_type']),
+        'parent_name': form['parent_name'],
+        'parent_phone': form['parent_phone'],
+        'parent_email': form['parent_email'],
+        'vehicle_id': optional_field(form, 'vehicle_id', int),
+        'transport_distance_km': optional_field(form, 'transport_distance_km', parse_decimal)
+    }
+
+
+def fee_item_form_values(form):
+    """FeeItem column values from a submitted fee item form"""
+    return {
+        'name': form['name'],
+        'code': form['code'].upper(),
+        'description': form['description'],
+        'scope': FeeScope(form['scope']),
+        'is_per_km': bool(form.get('is_per_km'))
+    }
+
+
+def fee_rate_form_values(form):
+    """FeeRate column values from a submitted fee rate form"""
+    return {
+        'fee_item_id': int(form['fee_item_id']),
+        'term': int(form['term']),
+        'year': int(form['year']),
+        'class_id': optional_field(form, 'class_id', int),
+        'stream_id': optional_field(form, 'stream_id', int),
+        'student_type': optional_field(form, 'student_type', StudentType),
+        'amount': optional_field(form, 'amount', parse_decimal),
+        'rate_per_km': optional_field(form, 'rate_per_km', parse_decimal)
+    }
+
+
+def expense_form_values(form):
+    """Expense column values from a submitted expense form"""
+    return {
+        'category_id': int(form['category_id']),
+        'description': form['description'],
+        'amount': parse_decimal(form['amount']),
+        'expense_date': date.fromisoformat(form['expense_date']),
+        'payment_method': optional_field(form, 'payment_method', PaymentMode),
+        'reference_number': form.get('reference_number'),
+        'supplier_name': form.get('supplier_name'),
+        'approved_by': form.get('approved_by')
+    }
+
+
 # ===========================
 #  AUTHENTICATION ROUTES
 # ===========================
@@ -142,10 +254,15 @@ def auth_callback():
                 role=UserRole.ACCOUNTANT  # Default role
             )
             db.session.add(user)
-            db.session.commit()
 
+        # New and returning users are saved in a single commit
         user.last_login = datetime.utcnow()
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            flash('Sign-in could not be completed, please try again', 'error')
+            return redirect(url_for('index'))
 
         login_user(user)
         return redirect(url_for('dashboard'))
@@ -164,38 +281,46 @@ def logout():
 # ===========================
 #  DASHBOARD
 # ===========================
+def outstanding_balances_query():
+    """Active students owing fees with their balance, largest first, ranked in the database
+
+    Fees and payments are summed per student first so neither total is repeated by
+    the join; the balance matches Student.get_current_balance().
+    """
+    fees = db.session.query(
+        FeeAssessment.student_id,
+        func.sum(FeeAssessment.amount).label('total')
+    ).group_by(FeeAssessment.student_id).subquery()
+    paid = db.session.query(
+        Payment.student_id,
+        func.sum(Payment.amount).label('total')
+    ).group_by(Payment.student_id).subquery()
+    balance = (fees.c.total - func.coalesce(paid.c.total, 0)).label('balance')
+
+    return db.session.query(Student, balance) \
+        .join(fees, fees.c.student_id == Student.id) \
+        .outerjoin(paid, paid.c.student_id == Student.id) \
+        .filter(Student.is_active == True, balance > 0) \
+        .order_by(desc('balance'))
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get current academic year
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
-
     # Basic statistics
-    stats = {
-        'total_students': Student.query.filter_by(is_active=True).count(),
-        'total_classes': Class.query.count(),
-        'total_vehicles': Vehicle.query.filter_by(is_active=True).count(),
-        'current_year': current_year.year if current_year else 'Not Set'
-    }
+    stats = get_dashboard_stats()
 
     # Recent payments (last 10)
-    recent_payments = Payment.query.order_by(desc(Payment.created_at)).limit(10).all()
+    recent_payments = Payment.query.options(selectinload(Payment.student)) \
+        .order_by(desc(Payment.created_at)).limit(10).all()
 
     # Students with outstanding balances
-    students_with_balances = []
-    students = Student.query.filter_by(is_active=True).limit(20).all()  # Limit for performance
+    top_balances = outstanding_balances_query().limit(10).all()  # Top 10 outstanding
 
-    for student in students:
-        balance = student.get_current_balance()
-        if balance > 0:
-            students_with_balances.append({
-                'student': student,
-                'balance': balance
-            })
-
-    # Sort by balance descending
-    students_with_balances.sort(key=lambda x: x['balance'], reverse=True)
-    students_with_balances = students_with_balances[:10]  # Top 10 outstanding
+    students_with_balances = [
+        {'student': student, 'balance': Decimal(str(amount))}
+        for student, amount in top_balances
+    ]
 
     return render_template('dashboard.html',
                            stats=stats,
@@ -209,7 +334,7 @@ def dashboard():
 @app.route('/academic')
 @login_required
 def academic_management():
-    classes = Class.query.all()
+    classes = get_all_classes()
     academic_years = AcademicYear.query.order_by(desc(AcademicYear.year)).all()
     return render_template('academic/index.html', classes=classes, academic_years=academic_years)
 
@@ -228,7 +353,7 @@ def add_class():
         flash('Class added successfully', 'success')
         return redirect(url_for('academic_management'))
 
-    classes = Class.query.all()
+    classes = get_all_classes()
     return render_template('academic/add_class.html', classes=classes)
 
 
@@ -257,14 +382,14 @@ def add_academic_year():
     if request.method == 'POST':
         year = AcademicYear(
             year=int(request.form['year']),
-            start_date=datetime.strptime(request.form['start_date'], '%Y-%m-%d').date(),
-            end_date=datetime.strptime(request.form['end_date'], '%Y-%m-%d').date(),
+            start_date=date.fromisoformat(request.form['start_date']),
+            end_date=date.fromisoformat(request.form['end_date']),
             is_current=bool(request.form.get('is_current'))
         )
 
         if year.is_current:
-            # Unset other current years
-            AcademicYear.query.update({'is_current': False})
+            # Unset the previous current year; other rows are left untouched
+            AcademicYear.query.filter_by(is_current=True).update({'is_current': False})
 
         db.session.add(year)
         db.session.commit()
@@ -303,9 +428,12 @@ def student_list():
     if stream_id:
         query = query.filter_by(stream_id=stream_id)
 
-    students = query.paginate(page=page, per_page=per_page, error_out=False)
-    classes = Class.query.all()
-    streams = Stream.query.filter_by(class_id=class_id).all() if class_id else []
+    # Class and stream names for the page load in one batch each
+    students = query.options(
+        selectinload(Student.class_obj), selectinload(Student.stream), *strict_loading(Student)
+    ).paginate(page=page, per_page=per_page, error_out=False)
+    classes = get_all_classes()
+    streams = get_stream_options(class_id) if class_id else []
 
     return render_template('students/list.html',
                            students=students,
@@ -320,37 +448,30 @@ def student_list():
 @login_required
 def add_student():
     if request.method == 'POST':
-        student = Student(
-            admission_no=request.form['admission_no'],
-            first_name=request.form['first_name'],
-            last_name=request.form['last_name'],
-            date_of_birth=datetime.strptime(request.form['date_of_birth'], '%Y-%m-%d').date() if request.form[
-                'date_of_birth'] else None,
-            class_id=int(request.form['class_id']),
-            stream_id=int(request.form['stream_id']) if request.form['stream_id'] else None,
-            student_type=StudentType(request.form['student_type']),
-            parent_name=request.form['parent_name'],
-            parent_phone=request.form['parent_phone'],
-            parent_email=request.form['parent_email'],
-            vehicle_id=int(request.form['vehicle_id']) if request.form['vehicle_id'] else None,
-            transport_distance_km=Decimal(request.form['transport_distance_km']) if request.form[
-                'transport_distance_km'] else None
-        )
+        try:
+            student = Student(**student_form_values(request.form))
+        except ValueError as e:
+            flash(f'Invalid student details: {e}', 'error')
+            return redirect(request.url)
 
         db.session.add(student)
         db.session.commit()
         flash('Student added successfully', 'success')
         return redirect(url_for('student_list'))
 
-    classes = Class.query.all()
-    vehicles = Vehicle.query.filter_by(is_active=True).all()
+    classes = get_all_classes()
+    vehicles = get_active_vehicles()
     return render_template('students/add.html', classes=classes, vehicles=vehicles)
 
 
 @app.route('/students/<int:student_id>')
 @login_required
 def student_detail(student_id):
-    student = Student.query.get_or_404(student_id)
+    # Everything the page shows about the student arrives with it instead of lazily per section
+    student = Student.query.options(
+        joinedload(Student.class_obj), joinedload(Student.stream), joinedload(Student.vehicle),
+        selectinload(Student.fee_assignments).selectinload(StudentFeeAssignment.fee_item)
+    ).filter_by(id=student_id).first_or_404()
     balance_summary = get_student_balance_summary(student_id)
 
     # Get recent payments
@@ -358,13 +479,13 @@ def student_detail(student_id):
         .order_by(desc(Payment.payment_date)).limit(10).all()
 
     # Get current term assessments
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    current_year = get_current_academic_year()
     current_assessments = []
     if current_year:
         current_assessments = FeeAssessment.query.filter_by(
             student_id=student_id,
             year=current_year.year
-        ).all()
+        ).options(selectinload(FeeAssessment.fee_item), selectinload(FeeAssessment.allocations)).all()
 
     return render_template('students/detail.html',
                            student=student,
@@ -377,8 +498,13 @@ def student_detail(student_id):
 @login_required
 def get_streams(class_id):
     """API endpoint to get streams for a class"""
-    streams = Stream.query.filter_by(class_id=class_id).all()
-    return jsonify([{'id': s.id, 'name': s.name} for s in streams])
+    response = jsonify(get_stream_options(class_id))
+
+    # Let the browser reuse the list briefly and revalidate it by content afterwards
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 # ===========================
@@ -419,21 +545,21 @@ def vehicle_detail(vehicle_id):
     vehicle = Vehicle.query.get_or_404(vehicle_id)
     students = Student.query.filter_by(vehicle_id=vehicle_id, is_active=True).all()
 
+    # Get current transport rate (simplified) once for all riders
+    rate = None
+    current_year = get_current_academic_year()
+    if current_year:
+        rate = FeeRate.query.join(FeeItem).filter(
+            FeeItem.code == 'TRANSPORT',
+            FeeRate.year == current_year.year
+        ).first()
+
     # Calculate total revenue for this vehicle
     total_revenue = 0
-    for student in students:
-        if student.transport_distance_km:
-            # Get current transport rate (simplified)
-            current_year = AcademicYear.query.filter_by(is_current=True).first()
-            if current_year:
-                transport_fee = FeeItem.query.filter_by(code='TRANSPORT').first()
-                if transport_fee:
-                    rate = FeeRate.query.filter_by(
-                        fee_item_id=transport_fee.id,
-                        year=current_year.year
-                    ).first()
-                    if rate and rate.rate_per_km:
-                        total_revenue += float(student.transport_distance_km * rate.rate_per_km * 3)  # 3 terms
+    if rate and rate.rate_per_km:
+        for student in students:
+            if student.transport_distance_km:
+                total_revenue += float(student.transport_distance_km * rate.rate_per_km * 3)  # 3 terms
 
     return render_template('vehicles/detail.html',
                            vehicle=vehicle,
@@ -451,7 +577,7 @@ def fee_management():
     term = request.args.get('term', 1, type=int)
     year = request.args.get('year', type=int)
 
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    current_year = get_current_academic_year()
 
     # Default to current year if not specified
     if not year and current_year:
@@ -472,7 +598,7 @@ def fee_management():
         ).all()
 
     # Get classes for the modal
-    classes = Class.query.all()
+    classes = get_all_classes()
 
     return render_template('fees/index.html',
                            fee_items=fee_items,
@@ -484,13 +610,11 @@ def fee_management():
 @login_required
 def add_fee_item():
     if request.method == 'POST':
-        fee_item = FeeItem(
-            name=request.form['name'],
-            code=request.form['code'].upper(),
-            description=request.form['description'],
-            scope=FeeScope(request.form['scope']),
-            is_per_km=bool(request.form.get('is_per_km'))
-        )
+        try:
+            fee_item = FeeItem(**fee_item_form_values(request.form))
+        except ValueError as e:
+            flash(f'Invalid fee item details: {e}', 'error')
+            return redirect(request.url)
 
         db.session.add(fee_item)
         db.session.commit()
@@ -504,16 +628,11 @@ def add_fee_item():
 @login_required
 def add_fee_rate():
     if request.method == 'POST':
-        rate = FeeRate(
-            fee_item_id=int(request.form['fee_item_id']),
-            term=int(request.form['term']),
-            year=int(request.form['year']),
-            class_id=int(request.form['class_id']) if request.form.get('class_id') else None,
-            stream_id=int(request.form['stream_id']) if request.form.get('stream_id') else None,  # Use .get() here
-            student_type=StudentType(request.form['student_type']) if request.form.get('student_type') else None,
-            amount=Decimal(request.form['amount']) if request.form.get('amount') else None,
-            rate_per_km=Decimal(request.form['rate_per_km']) if request.form.get('rate_per_km') else None
-        )
+        try:
+            rate = FeeRate(**fee_rate_form_values(request.form))
+        except ValueError as e:
+            flash(f'Invalid fee rate details: {e}', 'error')
+            return redirect(request.url)
 
         db.session.add(rate)
         db.session.commit()
@@ -521,8 +640,8 @@ def add_fee_rate():
         return redirect(url_for('fee_management'))
 
     fee_items = FeeItem.query.filter_by(is_active=True).all()
-    classes = Class.query.all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    classes = get_all_classes()
+    current_year = get_current_academic_year()
 
     return render_template('fees/add_rate.html',
                            fee_items=fee_items,
@@ -582,8 +701,8 @@ def assess_fees():
 
             return redirect(url_for('fee_management'))
 
-    classes = Class.query.all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    classes = get_all_classes()
+    current_year = get_current_academic_year()
 
     return render_template('fees/assess.html',
                            classes=classes,
@@ -608,11 +727,9 @@ def handle_fee_assessment_preview():
         elif assessment_scope == 'individual' and request.form.get('student_id'):
             query = query.filter_by(id=int(request.form['student_id']))
 
-        students = query.all()
-
         # Simulate assessment generation
         preview_data = {
-            'students_count': len(students),
+            'students_count': query.count(),
             'assessments_count': 0,
             'total_amount': 'KSh 0.00',
             'skipped_count': 0,
@@ -622,22 +739,47 @@ def handle_fee_assessment_preview():
 
         total_amount = Decimal('0')
         fee_totals = {}
-
-        for student in students:
-            # Check existing assessments if skip_existing is enabled
-            if skip_existing:
-                existing = FeeAssessment.query.filter_by(
-                    student_id=student.id,
-                    term=term,
-                    year=year
-                ).first()
-
-                if existing:
-                    preview_data['skipped_count'] += 1
-                    continue
-
-            # Get applicable fees for this student
-            applicable_fees = get_applicable_fees_for_student(student, term, year)
+        rate_index = build_rate_index(term, year)
+        assignment_index = build_assignment_index(term, year)
+        fee_items = FeeItem.query.filter_by(is_active=True).all()
+        profile_cache = {}
+
+        # Students already assessed for this term are left out of the pricing
+        target_query = query
+        if skip_existing:
+            assessed = db.session.query(FeeAssessment.student_id).filter(
+                FeeAssessment.term == term,
+                FeeAssessment.year == year
+            )
+            preview_data['skipped_count'] = query.filter(Student.id.in_(assessed)).count()
+            target_query = query.filter(Student.id.notin_(assessed))
+
+        # Students with individual assignments are priced one by one. Everyone else is
+        # charged purely by fee profile, so the database groups them and each profile
+        # is priced once for its head count. Any member id stands in for the group
+        # since none of them has an individual assignment.
+        assigned = db.session.query(StudentFeeAssignment.student_id).filter(
+            StudentFeeAssignment.term == term,
+            StudentFeeAssignment.year == year,
+            StudentFeeAssignment.is_active == True
+        )
+        priced_groups = [(student, 1) for student in
+                         with_fee_columns(target_query.filter(Student.id.in_(assigned))).all()]
+        profile_columns = (Student.class_id, Student.stream_id, Student.student_type,
+                           Student.transport_distance_km, Student.vehicle_id.isnot(None))
+        priced_groups += [(profile, profile.students) for profile in target_query.filter(
+            Student.id.notin_(assigned)
+        ).with_entities(
+            func.min(Student.id).label('id'),
+            *profile_columns[:4],
+            profile_columns[4].label('vehicle_id'),
+            func.count(Student.id).label('students')
+        ).group_by(*profile_columns)]
+
+        for student, head_count in priced_groups:
+            # Get applicable fees for this student (or group of identical students)
+            applicable_fees = get_applicable_fees_for_student(
+                student, term, year, rate_index, assignment_index, fee_items, profile_cache)
 
             for fee_item, rate_info in applicable_fees:
                 # Skip transport fees if not included
@@ -647,8 +789,8 @@ def handle_fee_assessment_preview():
                 amount = calculate_fee_amount(student, fee_item, rate_info)
 
                 if amount > 0:
-                    preview_data['assessments_count'] += 1
-                    total_amount += amount
+                    preview_data['assessments_count'] += head_count
+                    total_amount += amount * head_count
 
                     # Track fee breakdown
                     if fee_item.code not in fee_totals:
@@ -659,11 +801,11 @@ def handle_fee_assessment_preview():
                             'amount': Decimal('0')
                         }
 
-                    fee_totals[fee_item.code]['students_count'] += 1
-                    fee_totals[fee_item.code]['amount'] += amount
+                    fee_totals[fee_item.code]['students_count'] += head_count
+                    fee_totals[fee_item.code]['amount'] += amount * head_count
 
-        # Format fee breakdown
-        for code, data in fee_totals.items():
+        # Format fee breakdown, listed in fee item order
+        for data in (fee_totals[item.code] for item in fee_items if item.code in fee_totals):
             preview_data['fee_breakdown'].append({
                 'code': data['code'],
                 'name': data['name'],
@@ -678,7 +820,7 @@ def handle_fee_assessment_preview():
             preview_data['warnings'].append('No new assessments will be created with the current criteria.')
 
         if not include_transport:
-            transport_students = sum(1 for s in students if s.vehicle_id)
+            transport_students = query.filter(Student.vehicle_id.isnot(None)).count()
             if transport_students > 0:
                 preview_data['warnings'].append(
                     f'{transport_students} students have transport assignments but transport fees are excluded.')
@@ -691,24 +833,130 @@ def handle_fee_assessment_preview():
 
 # Also add these helper functions if they don't exist in your models.py
 
-def get_applicable_fees_for_student(student, term, year):
-    """Get all fee items applicable to a specific student"""
+def with_fee_columns(student_query):
+    """Narrow a student query to the columns fee resolution reads, skipping full ORM rows"""
+    return student_query.with_entities(
+        Student.id,
+        Student.class_id,
+        Student.stream_id,
+        Student.student_type,
+        Student.transport_distance_km,
+        Student.vehicle_id
+    )
+
+
+def build_rate_index(term, year):
+    """Load all active rates for a term once and index them by scope for dict lookups
+
+    Only the columns fee resolution reads are selected, so the index holds plain rows
+    rather than ORM objects.
+    """
+    rate_index = {}
+    rates = FeeRate.query.filter_by(term=term, year=year, is_active=True).with_entities(
+        FeeRate.id,
+        FeeRate.fee_item_id,
+        FeeRate.class_id,
+        FeeRate.stream_id,
+        FeeRate.student_type,
+        FeeRate.amount,
+        FeeRate.rate_per_km
+    ).order_by(FeeRate.id).all()
+
+    for rate in rates:
+        # setdefault keeps the first matching rate, as .first() would
+        if rate.class_id is None and rate.stream_id is None:
+            rate_index.setdefault(('universal', rate.fee_item_id), rate)
+        if rate.stream_id is not None:
+            rate_index.setdefault(('stream', rate.fee_item_id, rate.stream_id, rate.student_type), rate)
+        if rate.class_id is not None:
+            rate_index.setdefault(('class', rate.fee_item_id, rate.class_id, rate.student_type), rate)
+
+    return rate_index
+
+
+def build_assignment_index(term, year, student_id=None):
+    """Load active individual fee assignments for a term, keyed by (student_id, fee_item_id)"""
+    query = StudentFeeAssignment.query.filter_by(term=term, year=year, is_active=True)
+    if student_id:
+        query = query.filter_by(student_id=student_id)
+
+    # Plain rows carrying only the override columns fee resolution reads
+    query = query.with_entities(
+        StudentFeeAssignment.student_id,
+        StudentFeeAssignment.fee_item_id,
+        StudentFeeAssignment.custom_amount,
+        StudentFeeAssignment.custom_rate_per_km,
+        StudentFeeAssignment.custom_distance
+    )
+
+    assignment_index = {}
+    for assignment in query.order_by(StudentFeeAssignment.id).all():
+        assignment_index.setdefault((assignment.student_id, assignment.fee_item_id), assignment)
+
+    return assignment_index
+
+
+def find_standard_rate(fee_item, student, term, year, rate_index=None):
+    """Find the standard rate for a fee item that applies to a student's class, stream and type"""
+    if rate_index is None:
+        rate_index = build_rate_index(term, year)
+
+    if fee_item.scope == FeeScope.UNIVERSAL or fee_item.scope == FeeScope.INDIVIDUAL:
+        # Universal fees OR individual-scope fees with universal rates
+        return rate_index.get(('universal', fee_item.id))
+
+    elif fee_item.scope == FeeScope.STREAM_LEVEL and student.stream_id:
+        return (rate_index.get(('stream', fee_item.id, student.stream_id, student.student_type))
+                or rate_index.get(('stream', fee_item.id, student.stream_id, None)))
+
+    elif fee_item.scope == FeeScope.CLASS_LEVEL:
+        return (rate_index.get(('class', fee_item.id, student.class_id, student.student_type))
+                or rate_index.get(('class', fee_item.id, student.class_id, None)))
+
+    return None
+
+
+def get_applicable_fees_for_student(student, term, year, rate_index=None, assignment_index=None,
+                                    fee_items=None, profile_cache=None, rate_info_cache=None):
+    """Get all fee items applicable to a specific student
+
+    Args:
+        student: Student, or a with_fee_columns() row carrying the same attributes
+        rate_index: Optional result of build_rate_index() shared across a batch
+            so standard rates are resolved without a query per student
+        assignment_index: Optional result of build_assignment_index() shared
+            across a batch so individual assignments are not queried per fee item
+        fee_items: Optional list of active fee items shared across a batch
+        profile_cache: Optional dict shared across a batch holding the resolved
+            standard rates per (class_id, stream_id, student_type)
+        rate_info_cache: Optional dict shared across a batch holding the rate info
+            built per fee rate (and distance, for per-km fees); callers only read it
+    """
     applicable_fees = []
 
-    # Get all active fee items
-    fee_items = FeeItem.query.filter_by(is_active=True).all()
+    if rate_index is None:
+        rate_index = build_rate_index(term, year)
+    if assignment_index is None:
+        assignment_index = build_assignment_index(term, year, student.id)
 
-    for fee_item in fee_items:
+    # Get all active fee items
+    if fee_items is None:
+        fee_items = FeeItem.query.filter_by(is_active=True).all()
+
+    # Standard rates only depend on the student's class, stream and type
+    profile_key = (student.class_id, student.stream_id, student.student_type)
+    standard_rates = profile_cache.get(profile_key) if profile_cache is not None else None
+    if standard_rates is None:
+        standard_rates = [(fee_item, find_standard_rate(fee_item, student, term, year, rate_index))
+                          for fee_item in fee_items]
+        if profile_cache is not None:
+            profile_cache[profile_key] = standard_rates
+
+    for fee_item, rate in standard_rates:
         rate_info = None
 
         # Check for individual assignment first
-        individual_assignment = StudentFeeAssignment.query.filter_by(
-            student_id=student.id,
-            fee_item_id=fee_item.id,
-            term=term,
-            year=year,
-            is_active=True
-        ).first()
+        individual_assignment = assignment_index.get((student.id, fee_item.id))
 
         if individual_assignment:
             if individual_assignment.custom_amount:
@@ -728,77 +976,89 @@ def get_applicable_fees_for_student(student, term, year):
 
         # If no individual assignment found, look for standard rates
         # THIS IS THE KEY FIX - check standard rates regardless of scope
-        if not rate_info:
-            if fee_item.scope == FeeScope.UNIVERSAL or fee_item.scope == FeeScope.INDIVIDUAL:
-                # Universal fees OR individual-scope fees with universal rates
-                rate = FeeRate.query.filter_by(
-                    fee_item_id=fee_item.id,
-                    term=term,
-                    year=year,
-                    class_id=None,
-                    stream_id=None,
-                    is_active=True
-                ).first()
-
-                if rate:
+        if not rate_info and rate:
+            # Additional check for transport: only apply if student has vehicle,
+            # decided before building rate info that would be thrown away
+            if not (fee_item.scope in (FeeScope.UNIVERSAL, FeeScope.INDIVIDUAL)
+                    and fee_item.code == 'TRANSPORT' and not student.vehicle_id):
+                if rate_info_cache is None:
                     rate_info = get_rate_info(rate, student, fee_item)
+                else:
+                    # Only per-km fees depend on the student, and only through the distance
+                    cache_key = (rate.id, student.transport_distance_km if fee_item.is_per_km else None)
+                    if cache_key not in rate_info_cache:
+                        rate_info_cache[cache_key] = get_rate_info(rate, student, fee_item)
+                    rate_info = rate_info_cache[cache_key]
 
-                    # Additional check for transport: only apply if student has vehicle
-                    if fee_item.code == 'TRANSPORT' and not student.vehicle_id:
-                        rate_info = None
+        if rate_info:
+            applicable_fees.append((fee_item, rate_info))
 
-            elif fee_item.scope == FeeScope.STREAM_LEVEL and student.stream_id:
-                # ... rest of stream logic
-                rate = FeeRate.query.filter_by(
-                    fee_item_id=fee_item.id,
-                    term=term,
-                    year=year,
-                    stream_id=student.stream_id,
-                    student_type=student.student_type,
-                    is_active=True
-                ).first()
+    return applicable_fees
 
-                if not rate:
-                    rate = FeeRate.query.filter_by(
-                        fee_item_id=fee_item.id,
-                        term=term,
-                        year=year,
-                        stream_id=student.stream_id,
-                        student_type=None,
-                        is_active=True
-                    ).first()
-
-                if rate:
-                    rate_info = get_rate_info(rate, student, fee_item)
 
-            elif fee_item.scope == FeeScope.CLASS_LEVEL:
-                # ... rest of class logic
-                rate = FeeRate.query.filter_by(
-                    fee_item_id=fee_item.id,
-                    term=term,
-                    year=year,
-                    class_id=student.class_id,
-                    student_type=student.student_type,
-                    is_active=True
-                ).first()
+def conflict_insert():
+    """Return the dialect's insert() supporting ON CONFLICT, or None when unavailable"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert
+    if dialect == 'sqlite':
+        return sqlite.insert
+    return None
 
-                if not rate:
-                    rate = FeeRate.query.filter_by(
-                        fee_item_id=fee_item.id,
-                        term=term,
-                        year=year,
-                        class_id=student.class_id,
-                        student_type=None,
-                        is_active=True
-                    ).first()
-
-                if rate:
-                    rate_info = get_rate_info(rate, student, fee_item)
 
-        if rate_info:
-            applicable_fees.append((fee_item, rate_info))
+def assessment_conflict_insert():
+    """Return the ON CONFLICT insert() for fee assessments, or None when it cannot be used
+
+    create_all() never adds constraints to an existing table, so databases created before
+    unique_student_fee_assessment existed have no (student_id, fee_item_id, term, year)
+    key for ON CONFLICT to target. Those fall back to the preloaded existence check.
+    """
+    insert = conflict_insert()
+    if insert is None:
+        return None
+
+    inspector = inspect(db.session.connection())
+    table_name = FeeAssessment.__tablename__
+    unique_keys = [constraint['column_names'] for constraint in inspector.get_unique_constraints(table_name)]
+    unique_keys += [index['column_names'] for index in inspector.get_indexes(table_name) if index['unique']]
+    if {'student_id', 'fee_item_id', 'term', 'year'} in [set(columns) for columns in unique_keys]:
+        return insert
+    return None
 
-    return applicable_fees
+
+def insert_fee_assessments(rows, insert, replace=False):
+    """Insert assessment rows, letting the unique constraint skip already assessed fees
+
+    Args:
+        insert: Result of assessment_conflict_insert(); None inserts the rows as given
+        replace: If True, update already assessed fees in place instead of skipping them
+
+    Returns:
+        Number of rows actually inserted or updated
+    """
+    if insert is None:
+        db.session.bulk_insert_mappings(FeeAssessment, rows)
+        return len(rows)
+
+    key_columns = ['student_id', 'fee_item_id', 'term', 'year']
+    stmt = insert(FeeAssessment.__table__)
+    if replace:
+        # Updating in place keeps the assessment id, so payment allocations stay attached
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: stmt.excluded[column] for column in rows[0] if column not in key_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=key_columns)
+    stmt = stmt.returning(FeeAssessment.__table__.c.id)
+    return len(db.session.execute(stmt, rows).all())
+
+
+def delete_fee_assessments(assessment_ids):
+    """Delete the given assessments in one statement"""
+    if assessment_ids:
+        FeeAssessment.query.filter(FeeAssessment.id.in_(assessment_ids)) \
+            .delete(synchronize_session=False)
 
 
 def generate_fee_assessments(term, year, class_id=None, stream_id=None, student_id=None, force_regenerate=False):
@@ -810,7 +1070,7 @@ def generate_fee_assessments(term, year, class_id=None, stream_id=None, student_
         class_id: Optional - limit to specific class
         stream_id: Optional - limit to specific stream
         student_id: Optional - assess single student
-        force_regenerate: If True, delete and recreate existing assessments
+        force_regenerate: If True, recalculate existing assessments
 
     Returns:
         Number of assessments created
@@ -826,47 +1086,83 @@ def generate_fee_assessments(term, year, class_id=None, stream_id=None, student_
     elif class_id:
         query = query.filter_by(class_id=class_id)
 
-    students = query.all()
+    new_assessments = []
+    replaced_ids = []
     assessments_created = 0
-
-    for student in students:
+    batch_size = 1000
+    assessed_date = date.today()
+    rate_index = build_rate_index(term, year)
+    assignment_index = build_assignment_index(term, year)
+    fee_items = FeeItem.query.filter_by(is_active=True).all()
+    profile_cache = {}
+    rate_info_cache = {}
+    insert = assessment_conflict_insert()
+    # Where ON CONFLICT can target the unique key, regenerated assessments are upserted in place
+    upsert = force_regenerate and insert is not None
+
+    # Existing assessments are skipped by the insert itself where ON CONFLICT can target the
+    # unique key, so they only need loading when they are about to be replaced or when the
+    # table lacks that key. One query maps each (student_id, fee_item_id) pair to its
+    # assessment id without building ORM objects.
+    existing_assessments = {}
+    if force_regenerate or insert is None:
+        existing_query = db.session.query(
+            FeeAssessment.student_id, FeeAssessment.fee_item_id, FeeAssessment.id
+        ).filter(
+            FeeAssessment.term == term,
+            FeeAssessment.year == year,
+            FeeAssessment.student_id.in_(query.with_entities(Student.id))
+        ).order_by(FeeAssessment.id)
+        for assessed_student_id, fee_item_id, assessment_id in existing_query:
+            existing_assessments.setdefault((assessed_student_id, fee_item_id), assessment_id)
+
+    # Stream students in chunks rather than loading the whole school at once
+    for student in with_fee_columns(query).yield_per(500):
         # Get all applicable fee items for this student
-        applicable_fees = get_applicable_fees_for_student(student, term, year)
+        applicable_fees = get_applicable_fees_for_student(
+            student, term, year, rate_index, assignment_index, fee_items, profile_cache,
+            rate_info_cache)
 
         for fee_item, rate_info in applicable_fees:
             # Check if assessment already exists
-            existing = FeeAssessment.query.filter_by(
-                student_id=student.id,
-                fee_item_id=fee_item.id,
-                term=term,
-                year=year
-            ).first()
+            existing_id = existing_assessments.get((student.id, fee_item.id))
 
-            if existing:
-                if not force_regenerate:
-                    continue  # Skip if already assessed and not forcing regenerate
-                else:
-                    # Delete existing assessment if forcing regenerate
-                    db.session.delete(existing)
-                    db.session.flush()  # Ensure deletion is processed
+            if existing_id and not force_regenerate:
+                continue  # Skip if already assessed and not forcing regenerate
 
             # Calculate amount
             amount = calculate_fee_amount(student, fee_item, rate_info)
 
-            if amount > 0:
-                assessment = FeeAssessment(
-                    student_id=student.id,
-                    fee_item_id=fee_item.id,
-                    term=term,
-                    year=year,
-                    description=f"{fee_item.name} - Term {term} {year}",
-                    amount=amount,
-                    base_rate=rate_info.get('base_rate'),
-                    quantity=rate_info.get('quantity', 1)
-                )
+            if existing_id and (amount <= 0 or not upsert):
+                # Delete existing assessment if forcing regenerate and it is not upserted
+                replaced_ids.append(existing_id)
 
-                db.session.add(assessment)
-                assessments_created += 1
+            if amount > 0:
+                new_assessments.append({
+                    'student_id': student.id,
+                    'fee_item_id': fee_item.id,
+                    'term': term,
+                    'year': year,
+                    'description': f"{fee_item.name} - Term {term} {year}",
+                    'amount': amount,
+                    'base_rate': rate_info['base_rate'],
+                    'quantity': rate_info['quantity'],
+                    'assessed_date': assessed_date
+                })
+
+        # Write completed batches as we go so memory stays bounded on large runs
+        if len(new_assessments) >= batch_size:
+            delete_fee_assessments(replaced_ids)  # Before inserting their replacements
+            replaced_ids = []
+            assessments_created += insert_fee_assessments(new_assessments, insert, upsert)
+            new_assessments = []
+
+    # Process the deletions before inserting their replacements
+    delete_fee_assessments(replaced_ids)
+
+    # Insert all new rows in one executemany instead of one ORM flush per assessment
+    if new_assessments:
+        assessments_created += insert_fee_assessments(new_assessments, insert, upsert)
 
     db.session.commit()
     return assessments_created
@@ -890,10 +1186,22 @@ def get_rate_info(fee_rate, student, fee_item):
 
 def calculate_fee_amount(student, fee_item, rate_info):
     """Calculate the actual fee amount"""
-    base_rate = rate_info.get('base_rate', 0)
-    quantity = rate_info.get('quantity', 1)
+    # Every rate info dict carries both keys
+    base_rate = rate_info['base_rate']
+    quantity = rate_info['quantity']
+
+    # Numeric columns already load as Decimal; only convert ints/floats
+    if not isinstance(base_rate, Decimal):
+        base_rate = Decimal(str(base_rate))
+
+    # Fixed fees are by far the common case and need no multiplication
+    if quantity == 1:
+        return base_rate
 
-    return Decimal(str(base_rate)) * Decimal(str(quantity))
+    if not isinstance(quantity, Decimal):
+        quantity = Decimal(str(quantity))
+
+    return base_rate * quantity
 
 @app.route('/fees/individual/<int:student_id>', methods=['GET', 'POST'])
 @login_required
@@ -920,7 +1228,7 @@ def individual_fee_assignment(student_id):
         return redirect(url_for('student_detail', student_id=student_id))
 
     fee_items = FeeItem.query.filter_by(is_active=True).all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    current_year = get_current_academic_year()
     existing_assignments = StudentFeeAssignment.query.filter_by(
         student_id=student_id,
         is_active=True
@@ -961,12 +1269,16 @@ def payment_list():
         query = query.filter_by(payment_mode=PaymentMode(payment_mode))
 
     if from_date:
-        query = query.filter(Payment.payment_date >= datetime.strptime(from_date, '%Y-%m-%d').date())
+        query = query.filter(Payment.payment_date >= date.fromisoformat(from_date))
 
     if to_date:
-        query = query.filter(Payment.payment_date <= datetime.strptime(to_date, '%Y-%m-%d').date())
+        query = query.filter(Payment.payment_date <= date.fromisoformat(to_date))
 
-    payments = query.order_by(desc(Payment.created_at)) \
+    payments = query.options(
+        selectinload(Payment.student).selectinload(Student.class_obj),
+        selectinload(Payment.student).selectinload(Student.stream),
+        selectinload(Payment.processor)
+    ).order_by(desc(Payment.created_at)) \
         .paginate(page=page, per_page=per_page, error_out=False)
 
     return render_template('payments/list.html', payments=payments, search=search)
@@ -978,16 +1290,11 @@ def add_payment(student_id):
     student = Student.query.get_or_404(student_id)
 
     if request.method == 'POST':
-        # Generate receipt number
-        last_receipt = Payment.query.order_by(desc(Payment.id)).first()
-        receipt_no = f"RCT{(last_receipt.id + 1):06d}" if last_receipt else "RCT000001"
-
         payment = Payment(
             student_id=student_id,
             amount=Decimal(request.form['amount']),
-            payment_date=datetime.strptime(request.form['payment_date'], '%Y-%m-%d').date(),
+            payment_date=date.fromisoformat(request.form['payment_date']),
             payment_mode=PaymentMode(request.form['payment_mode']),
-            receipt_number=receipt_no,
             mpesa_code=request.form.get('mpesa_code'),
             bank_slip_number=request.form.get('bank_slip_number'),
             cheque_number=request.form.get('cheque_number'),
@@ -995,29 +1302,41 @@ def add_payment(student_id):
             processed_by=current_user.id
         )
 
-        db.session.add(payment)
-        db.session.commit()
+        # Receipt numbers come from the counter row, taken in the same transaction as
+        # the insert; the unique constraint still guards against older receipts that
+        # already use the number, skipping further ahead on each retry
+        for attempt in range(3):
+            receipt_no = f"RCT{next_receipt_sequence(skip=attempt):06d}"
+            payment.receipt_number = receipt_no
+            db.session.add(payment)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+        else:
+            flash('Could not generate a unique receipt number, please try again', 'error')
+            return redirect(url_for('add_payment', student_id=student_id))
 
         flash(f'Payment {receipt_no} recorded successfully', 'success')
         return redirect(url_for('allocate_payment', payment_id=payment.id))
 
-    # Get outstanding assessments with proper calculation
-    outstanding_assessments = []
-    assessments = FeeAssessment.query.filter_by(student_id=student_id).all()
-
-    for assessment in assessments:
-        # Calculate how much has been paid for this assessment
-        paid_amount = db.session.query(func.sum(PaymentAllocation.amount)) \
-                          .filter_by(assessment_id=assessment.id).scalar() or Decimal('0')
-
-        outstanding = assessment.amount - paid_amount
+    # Get outstanding assessments, netting allocations in the same query
+    outstanding_rows = db.session.query(
+        FeeAssessment,
+        (FeeAssessment.amount - func.coalesce(func.sum(PaymentAllocation.amount), 0)).label('outstanding')
+    ).filter_by(student_id=student_id) \
+        .outerjoin(PaymentAllocation) \
+        .options(selectinload(FeeAssessment.fee_item)) \
+        .group_by(FeeAssessment.id) \
+        .having(func.coalesce(func.sum(PaymentAllocation.amount), 0) < FeeAssessment.amount) \
+        .order_by(FeeAssessment.year, FeeAssessment.term, FeeAssessment.id) \
+        .all()
 
-        # Only include if there's an outstanding balance
-        if outstanding > 0:
-            outstanding_assessments.append({
-                'assessment': assessment,
-                'outstanding': outstanding
-            })
+    outstanding_assessments = [
+        {'assessment': assessment, 'outstanding': outstanding}
+        for assessment, outstanding in outstanding_rows
+    ]
 
     return render_template('payments/add.html',
                            student=student,
@@ -1027,7 +1346,11 @@ def add_payment(student_id):
 @app.route('/payments/<int:payment_id>/allocate', methods=['GET', 'POST'])
 @login_required
 def allocate_payment(payment_id):
-    payment = Payment.query.get_or_404(payment_id)
+    query = Payment.query.filter_by(id=payment_id)
+    if request.method == 'POST':
+        # Hold the payment row until commit so concurrent allocations queue up
+        query = query.with_for_update()
+    payment = query.first_or_404()
 
     if request.method == 'POST':
         try:
@@ -1036,6 +1359,8 @@ def allocate_payment(payment_id):
             total_allocated = Decimal('0')
             allocations_to_create = []
 
+            # Parse the assessment_id:amount pairs first, skipping malformed entries
+            parsed_inputs = []
             for allocation_data in allocation_inputs:
                 # Skip empty values
                 if not allocation_data or not allocation_data.strip():
@@ -1052,51 +1377,62 @@ def allocate_payment(payment_id):
 
                     assessment_id = int(parts[0])
                     amount = Decimal(parts[1])
-
-                    # Skip zero or negative amounts
-                    if amount <= 0:
-                        continue
-
-                    # Verify the assessment exists and belongs to this student
-                    assessment = FeeAssessment.query.get(assessment_id)
-                    if not assessment or assessment.student_id != payment.student_id:
-                        flash(f'Invalid assessment ID: {assessment_id}', 'error')
-                        continue
-
-                    # Check if amount exceeds outstanding balance for this assessment
-                    already_allocated = db.session.query(func.sum(PaymentAllocation.amount)) \
-                                            .filter_by(assessment_id=assessment_id).scalar() or Decimal('0')
-                    outstanding = assessment.amount - already_allocated
-
-                    if amount > outstanding:
-                        flash(f'Amount for {assessment.fee_item.name} exceeds outstanding balance', 'warning')
-                        amount = outstanding
-
-                    allocations_to_create.append({
-                        'assessment_id': assessment_id,
-                        'amount': amount
-                    })
-                    total_allocated += amount
-
                 except (ValueError, TypeError) as e:
                     # Skip malformed allocation data
                     continue
 
-            # Validate total allocation doesn't exceed payment amount
-            if total_allocated > payment.amount:
+                # Skip zero or negative amounts
+                if amount > 0:
+                    parsed_inputs.append((assessment_id, amount))
+
+            # Load every referenced assessment with its allocated total in one query
+            assessment_rows = {}
+            if parsed_inputs:
+                rows = db.session.query(
+                    FeeAssessment,
+                    func.coalesce(func.sum(PaymentAllocation.amount), 0).label('allocated')
+                ).filter(FeeAssessment.id.in_({assessment_id for assessment_id, _ in parsed_inputs})) \
+                    .outerjoin(PaymentAllocation) \
+                    .options(selectinload(FeeAssessment.fee_item)) \
+                    .group_by(FeeAssessment.id) \
+                    .all()
+                assessment_rows = {assessment.id: (assessment, allocated) for assessment, allocated in rows}
+
+            for assessment_id, amount in parsed_inputs:
+                # Verify the assessment exists and belongs to this student
+                assessment, already_allocated = assessment_rows.get(assessment_id, (None, 0))
+                if not assessment or assessment.student_id != payment.student_id:
+                    flash(f'Invalid assessment ID: {assessment_id}', 'error')
+                    continue
+
+                # Check if amount exceeds outstanding balance for this assessment
+                outstanding = assessment.amount - already_allocated
+
+                if amount > outstanding:
+                    flash(f'Amount for {assessment.fee_item.name} exceeds outstanding balance', 'warning')
+                    amount = outstanding
+
+                allocations_to_create.append({
+                    'assessment_id': assessment_id,
+                    'amount': amount
+                })
+                total_allocated += amount
+
+            # Validate total allocation doesn't exceed payment amount,
+            # counting what is already allocated from this payment
+            already_allocated = db.session.query(
+                func.sum(PaymentAllocation.amount)
+            ).filter_by(payment_id=payment.id).scalar() or 0
+            if total_allocated + already_allocated > payment.amount:
                 flash('Total allocation exceeds payment amount', 'error')
                 db.session.rollback()
             elif total_allocated == 0:
                 flash('No valid allocations provided', 'warning')
             else:
-                # Create all allocations
-                for alloc_data in allocations_to_create:
-                    allocation = PaymentAllocation(
-                        payment_id=payment_id,
-                        assessment_id=alloc_data['assessment_id'],
-                        amount=alloc_data['amount']
-                    )
-                    db.session.add(allocation)
+                # Create all allocations in one batched INSERT
+                db.session.bulk_insert_mappings(PaymentAllocation, [
+                    {'payment_id': payment_id, **alloc_data} for alloc_data in allocations_to_create
+                ])
 
                 db.session.commit()
                 # Format currency manually instead of using |currency filter
@@ -1113,6 +1449,7 @@ def allocate_payment(payment_id):
         (FeeAssessment.amount - func.coalesce(func.sum(PaymentAllocation.amount), 0)).label('outstanding')
     ).filter_by(student_id=payment.student_id) \
         .outerjoin(PaymentAllocation) \
+        .options(selectinload(FeeAssessment.fee_item)) \
         .group_by(FeeAssessment.id) \
         .having(func.coalesce(func.sum(PaymentAllocation.amount), 0) < FeeAssessment.amount) \
         .all()
@@ -1126,7 +1463,10 @@ def allocate_payment(payment_id):
 @login_required
 def edit_payment(payment_id):
     """Edit an existing payment record"""
-    payment = Payment.query.get_or_404(payment_id)
+    query = Payment.query.filter_by(id=payment_id)
+    if request.method == 'POST':
+        query = query.with_for_update()
+    payment = query.first_or_404()
 
     if request.method == 'POST':
         try:
@@ -1137,7 +1477,7 @@ def edit_payment(payment_id):
 
             # Update payment details
             payment.amount = Decimal(request.form['amount'])
-            payment.payment_date = datetime.strptime(request.form['payment_date'], '%Y-%m-%d').date()
+            payment.payment_date = date.fromisoformat(request.form['payment_date'])
             payment.payment_mode = PaymentMode(request.form['payment_mode'])
 
             # Update payment method specific fields
@@ -1223,63 +1563,71 @@ def class_summary_report():
     year = request.args.get('year', type=int)
     class_id = request.args.get('class_id', type=int)
 
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    current_year = get_current_academic_year()
     if not term and current_year:
         year = current_year.year
         term = 1  # Default to term 1
 
     # Get class summary data
-    classes = Class.query.all()
+    classes = get_all_classes()
     summary_data = []
 
     target_classes = [Class.query.get(class_id)] if class_id else classes
+    target_classes = [cls for cls in target_classes if cls]
+
+    # Assessed and allocated totals per student for the term, summed separately so
+    # that an assessment paid in instalments is not counted once per allocation
+    assessed = db.session.query(
+        FeeAssessment.student_id,
+        func.sum(FeeAssessment.amount).label('total')
+    ).filter(FeeAssessment.term == term, FeeAssessment.year == year) \
+        .group_by(FeeAssessment.student_id).subquery()
+    paid = db.session.query(
+        FeeAssessment.student_id,
+        func.sum(PaymentAllocation.amount).label('total')
+    ).join(PaymentAllocation, PaymentAllocation.assessment_id == FeeAssessment.id) \
+        .filter(FeeAssessment.term == term, FeeAssessment.year == year) \
+        .group_by(FeeAssessment.student_id).subquery()
+
+    # One row per class and stream for all target classes
+    stream_rows = db.session.query(
+        Student.class_id,
+        Stream.name.label('stream_name'),
+        func.count(Student.id).label('students'),
+        func.coalesce(func.sum(assessed.c.total), 0).label('assessed'),
+        func.coalesce(func.sum(paid.c.total), 0).label('paid')
+    ).outerjoin(Stream, Student.stream_id == Stream.id) \
+        .outerjoin(assessed, assessed.c.student_id == Student.id) \
+        .outerjoin(paid, paid.c.student_id == Student.id) \
+        .filter(Student.is_active == True,
+                Student.class_id.in_([cls.id for cls in target_classes])) \
+        .group_by(Student.class_id, Student.stream_id, Stream.name) \
+        .order_by(Student.class_id, func.min(Student.id)) \
+        .all()
 
-    for cls in target_classes:
-        if not cls:
-            continue
-
-        students = Student.query.filter_by(class_id=cls.id, is_active=True).all()
+    streams_by_class = {}
+    for row in stream_rows:
+        streams_by_class.setdefault(row.class_id, []).append(row)
 
+    for cls in target_classes:
         class_summary = {
             'class': cls,
-            'total_students': len(students),
+            'total_students': 0,
             'total_assessed': 0,
             'total_paid': 0,
             'outstanding': 0,
             'streams': {}
         }
 
-        for student in students:
-            # Get student assessments for this term/year
-            assessments = FeeAssessment.query.filter_by(
-                student_id=student.id,
-                term=term,
-                year=year
-            ).all() if term and year else []
-
-            student_assessed = sum(a.amount for a in assessments)
-
-            # Get student payments allocated to these assessments
-            student_paid = db.session.query(func.sum(PaymentAllocation.amount)) \
-                               .join(FeeAssessment) \
-                               .filter(FeeAssessment.student_id == student.id,
-                                       FeeAssessment.term == term,
-                                       FeeAssessment.year == year) \
-                               .scalar() or 0
-
-            class_summary['total_assessed'] += student_assessed
-            class_summary['total_paid'] += student_paid
+        for row in streams_by_class.get(cls.id, []):
+            class_summary['total_students'] += row.students
+            class_summary['total_assessed'] += row.assessed
+            class_summary['total_paid'] += row.paid
 
             # Stream breakdown
-            stream_key = student.stream.name if student.stream else 'No Stream'
-            if stream_key not in class_summary['streams']:
-                class_summary['streams'][stream_key] = {
-                    'students': 0, 'assessed': 0, 'paid': 0
-                }
-
-            class_summary['streams'][stream_key]['students'] += 1
-            class_summary['streams'][stream_key]['assessed'] += student_assessed
-            class_summary['streams'][stream_key]['paid'] += student_paid
+            class_summary['streams'][row.stream_name or 'No Stream'] = {
+                'students': row.students, 'assessed': row.assessed, 'paid': row.paid
+            }
 
         class_summary['outstanding'] = class_summary['total_assessed'] - class_summary['total_paid']
         summary_data.append(class_summary)
@@ -1292,18 +1640,33 @@ def class_summary_report():
                            year=year)
 
 
+def strict_loading(entity):
+    """Loader options making unplanned lazy loads on entity raise while debugging or testing,
+    so report queries cannot silently regress into a SELECT per row
+
+    The raise is scoped to the query's lead entity; objects pulled in by selectinload()
+    keep their normal lazy loading.
+    """
+    return [Load(entity).raiseload('*', sql_only=True)] if app.debug or app.testing else []
+
+
 @app.route('/reports/student_statement/<int:student_id>')
 @login_required
 def student_statement(student_id):
-    student = Student.query.get_or_404(student_id)
+    student = Student.query.filter_by(id=student_id) \
+        .options(selectinload(Student.class_obj), selectinload(Student.stream),
+                 selectinload(Student.vehicle), *strict_loading(Student)) \
+        .first_or_404()
     balance_summary = get_student_balance_summary(student_id)
 
     # Get detailed transaction history
     assessments = FeeAssessment.query.filter_by(student_id=student_id) \
+        .options(selectinload(FeeAssessment.fee_item), *strict_loading(FeeAssessment)) \
         .order_by(FeeAssessment.year, FeeAssessment.term) \
         .all()
 
     payments = Payment.query.filter_by(student_id=student_id) \
+        .options(*strict_loading(Payment)) \
         .order_by(Payment.payment_date) \
         .all()
 
@@ -1319,24 +1682,18 @@ def student_statement(student_id):
 def outstanding_fees_report():
     class_id = request.args.get('class_id', type=int)
 
-    query = Student.query.filter_by(is_active=True)
+    # Balances are ranked in SQL; class and stream names load in one batch each
+    query = outstanding_balances_query().options(
+        selectinload(Student.class_obj), selectinload(Student.stream))
     if class_id:
-        query = query.filter_by(class_id=class_id)
-
-    students_with_outstanding = []
+        query = query.filter(Student.class_id == class_id)
 
-    for student in query.all():
-        balance = student.get_current_balance()
-        if balance > 0:
-            students_with_outstanding.append({
-                'student': student,
-                'balance': balance
-            })
-
-    # Sort by balance descending
-    students_with_outstanding.sort(key=lambda x: x['balance'], reverse=True)
+    students_with_outstanding = [
+        {'student': student, 'balance': Decimal(str(balance))}
+        for student, balance in query.all()
+    ]
 
-    classes = Class.query.all()
+    classes = get_all_classes()
 
     return render_template('reports/outstanding_fees.html',
                            students_with_outstanding=students_with_outstanding,
@@ -1350,7 +1707,7 @@ def vehicle_revenue_report():
     term = request.args.get('term', type=int)
     year = request.args.get('year', type=int)
 
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    current_year = get_current_academic_year()
     if not term and current_year:
         year = current_year.year
         term = 1
@@ -1371,11 +1728,34 @@ def vehicle_revenue_report():
             is_active=True
         ).first()
 
+    # All riders of the listed vehicles in one query, grouped by vehicle in Python
+    vehicle_ids = [vehicle.id for vehicle in vehicles]
+    riders = Student.query.filter(
+        Student.vehicle_id.in_(vehicle_ids),
+        Student.is_active == True
+    ).options(selectinload(Student.class_obj), selectinload(Student.stream), *strict_loading(Student)) \
+        .order_by(Student.id).all()
+    students_by_vehicle = {}
+    for student in riders:
+        students_by_vehicle.setdefault(student.vehicle_id, []).append(student)
+
+    # Payments allocated to each rider's transport assessments this term, in one grouped query
+    paid_by_student = {}
+    if transport_fee and term and year:
+        paid_by_student = dict(db.session.query(
+            FeeAssessment.student_id,
+            func.sum(PaymentAllocation.amount)
+        ).join(PaymentAllocation, PaymentAllocation.assessment_id == FeeAssessment.id) \
+            .join(Student, Student.id == FeeAssessment.student_id) \
+            .filter(FeeAssessment.fee_item_id == transport_fee.id,
+                    FeeAssessment.term == term,
+                    FeeAssessment.year == year,
+                    Student.vehicle_id.in_(vehicle_ids),
+                    Student.is_active == True) \
+            .group_by(FeeAssessment.student_id).all())
+
     for vehicle in vehicles:
-        students = Student.query.filter_by(
-            vehicle_id=vehicle.id,
-            is_active=True
-        ).all()
+        students = students_by_vehicle.get(vehicle.id, [])
 
         vehicle_summary = {
             'vehicle': vehicle,
@@ -1396,23 +1776,8 @@ def vehicle_revenue_report():
             if rate and rate.rate_per_km:
                 assessed_amount = Decimal(str(student.transport_distance_km)) * rate.rate_per_km
 
-            # Get actual payments for this student's transport fees
-            paid_amount = Decimal('0')
-            if transport_fee and term and year:
-                # Get transport assessments for this student in this term
-                transport_assessments = FeeAssessment.query.filter_by(
-                    student_id=student.id,
-                    fee_item_id=transport_fee.id,
-                    term=term,
-                    year=year
-                ).all()
-
-                # Sum up payments allocated to these assessments
-                for assessment in transport_assessments:
-                    allocated = db.session.query(func.sum(PaymentAllocation.amount)) \
-                                    .filter_by(assessment_id=assessment.id) \
-                                    .scalar() or 0
-                    paid_amount += Decimal(str(allocated))
+            # Actual payments for this student's transport fees
+            paid_amount = Decimal(str(paid_by_student.get(student.id) or 0))
 
             balance = assessed_amount - paid_amount
 
@@ -1454,9 +1819,6 @@ def vehicle_revenue_report():
 @app.route('/expenses')
 @login_required
 def expense_list():
-    from datetime import datetime, timedelta
-    from sqlalchemy import func, extract
-
     page = request.args.get('page', 1, type=int)
     per_page = 20
 
@@ -1476,52 +1838,56 @@ def expense_list():
     current_month = current_date.month
     current_year = current_date.year
 
-    # Base query for filtered calculations
-    base_query = Expense.query
+    # Date ranges compare directly against expense_date so its index can be used
+    month_start = current_date.date().replace(day=1)
+    next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+    last_month_start = (month_start - timedelta(days=1)).replace(day=1)
+    year_start = month_start.replace(month=1)
+    next_year_start = year_start.replace(year=current_year + 1)
+
+    def period_total(start, end):
+        in_period = and_(Expense.expense_date >= start, Expense.expense_date < end)
+        return func.sum(case((in_period, Expense.amount), else_=0))
+
+    # This month, this year, last month and all-time totals in one pass
+    totals_query = db.session.query(
+        period_total(month_start, next_month_start).label('this_month'),
+        period_total(year_start, next_year_start).label('this_year'),
+        period_total(last_month_start, month_start).label('last_month'),
+        func.sum(Expense.amount).label('total')
+    )
     if category_id:
-        base_query = base_query.filter_by(category_id=category_id)
-
-    # This month's expenses
-    this_month_total = base_query.filter(
-        extract('month', Expense.expense_date) == current_month,
-        extract('year', Expense.expense_date) == current_year
-    ).with_entities(func.sum(Expense.amount)).scalar() or 0
+        totals_query = totals_query.filter(Expense.category_id == category_id)
+    totals = totals_query.one()
 
-    # This year's expenses
-    this_year_total = base_query.filter(
-        extract('year', Expense.expense_date) == current_year
-    ).with_entities(func.sum(Expense.amount)).scalar() or 0
+    this_month_total = totals.this_month or 0
+    this_year_total = totals.this_year or 0
+    last_month_total = totals.last_month or 0
 
     # Calculate average per month (based on months this year that have passed)
     months_passed = current_month
     average_per_month = this_year_total / months_passed if months_passed > 0 and this_year_total > 0 else 0
 
     # Total expenses (all time or filtered)
-    total_expenses = base_query.with_entities(func.sum(Expense.amount)).scalar() or 0
-
-    # Calculate category breakdown for current month
-    category_breakdown = db.session.query(
-        ExpenseCategory.name,
-        ExpenseCategory.code,
-        func.sum(Expense.amount).label('total')
-    ).join(Expense).filter(
-        extract('month', Expense.expense_date) == current_month,
-        extract('year', Expense.expense_date) == current_year
-    ).group_by(ExpenseCategory.id).all()
+    total_expenses = totals.total or 0
+
+    # Top two categories this month; the cards show no more than that, and a view
+    # filtered to one category has no breakdown worth showing
+    category_breakdown = []
+    if not category_id:
+        category_breakdown = db.session.query(
+            ExpenseCategory.name,
+            ExpenseCategory.code,
+            func.sum(Expense.amount).label('total')
+        ).join(Expense).filter(
+            Expense.expense_date >= month_start,
+            Expense.expense_date < next_month_start
+        ).group_by(ExpenseCategory.id).order_by(desc('total')).limit(2).all()
 
     # Get top spending category this month
     top_category = category_breakdown[0] if category_breakdown else None
 
     # Calculate percentage change from last month
-    last_month = current_month - 1 if current_month > 1 else 12
-    last_month_year = current_year if current_month > 1 else current_year - 1
-
-    last_month_total = base_query.filter(
-        extract('month', Expense.expense_date) == last_month,
-        extract('year', Expense.expense_date) == last_month_year
-    ).with_entities(func.sum(Expense.amount)).scalar() or 0
-
-    # Calculate percentage change
     if last_month_total > 0:
         month_change_percent = ((float(this_month_total) - float(last_month_total)) / float(last_month_total)) * 100
     else:
@@ -1544,18 +1910,15 @@ def expense_list():
 @login_required
 def add_expense():
     if request.method == 'POST':
-        expense = Expense(
-            category_id=int(request.form['category_id']),
-            description=request.form['description'],
-            amount=Decimal(request.form['amount']),
-            expense_date=datetime.strptime(request.form['expense_date'], '%Y-%m-%d').date(),
-            payment_method=PaymentMode(request.form['payment_method']) if request.form['payment_method'] else None,
-            reference_number=request.form.get('reference_number'),
-            supplier_name=request.form.get('supplier_name'),
-            approved_by=request.form.get('approved_by'),
-            notes=request.form.get('notes'),
-            created_by=current_user.id
-        )
+        try:
+            expense = Expense(
+                **expense_form_values(request.form),
+                notes=request.form.get('notes'),
+                created_by=current_user.id
+            )
+        except ValueError as e:
+            flash(f'Invalid expense details: {e}', 'error')
+            return redirect(request.url)
 
         db.session.add(expense)
         db.session.commit()
@@ -1591,7 +1954,11 @@ def add_expense_category():
 @login_required
 def promotion_management():
     academic_years = AcademicYear.query.order_by(desc(AcademicYear.year)).all()
-    recent_promotions = StudentPromotion.query.order_by(desc(StudentPromotion.promotion_date)).limit(20).all()
+    recent_promotions = StudentPromotion.query.options(
+        selectinload(StudentPromotion.student),
+        selectinload(StudentPromotion.from_class),
+        selectinload(StudentPromotion.to_class)
+    ).order_by(desc(StudentPromotion.promotion_date)).limit(20).all()
 
     return render_template('promotions/index.html',
                            academic_years=academic_years,
@@ -1611,19 +1978,37 @@ def bulk_promotion():
         if stream_id:
             query = query.filter_by(stream_id=stream_id)
 
-        students = query.all()
+        from_class = db.session.get(Class, from_class_id)
+        next_class_id = from_class.next_class_id if from_class else None
         promoted_count = 0
 
-        for student in students:
-            if student.promote_to_next_class(academic_year, PromotionStatus.PROMOTED):
-                promoted_count += 1
+        if next_class_id:
+            students = query.with_entities(Student.id, Student.stream_id).all()
+
+            # Record every promotion in one batched INSERT, then move the
+            # whole group with a single UPDATE
+            db.session.bulk_insert_mappings(StudentPromotion, [
+                {
+                    'student_id': student.id,
+                    'from_class_id': from_class_id,
+                    'from_stream_id': student.stream_id,
+                    'to_class_id': next_class_id,
+                    'academic_year': academic_year,
+                    'status': PromotionStatus.PROMOTED,
+                    'promotion_date': date.today()
+                }
+                for student in students
+            ])
+            query.update({'class_id': next_class_id, 'stream_id': None},
+                         synchronize_session=False)
+            promoted_count = len(students)
 
         db.session.commit()
         flash(f'Successfully promoted {promoted_count} students', 'success')
         return redirect(url_for('promotion_management'))
 
-    classes = Class.query.all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    classes = get_all_classes()
+    current_year = get_current_academic_year()
 
     return render_template('promotions/bulk.html',
                            classes=classes,
@@ -1658,8 +2043,8 @@ def individual_promotion(student_id):
         flash('Student promotion processed successfully', 'success')
         return redirect(url_for('student_detail', student_id=student_id))
 
-    classes = Class.query.all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    classes = get_all_classes()
+    current_year = get_current_academic_year()
 
     return render_template('promotions/individual.html',
                            student=student,
@@ -1677,20 +2062,39 @@ def student_search():
     if len(query) < 2:
         return jsonify([])
 
-    students = Student.query.filter(
-        Student.is_active == True,
-        or_(
-            Student.admission_no.contains(query),
-            Student.first_name.contains(query),
-            Student.last_name.contains(query)
-        )
-    ).limit(10).all()
+    # Select only the serialized columns; the name is concatenated in SQL
+    search_query = db.session.query(
+        Student.id,
+        Student.admission_no,
+        Student.full_name.label('name'),
+        Class.name.label('class_name'),
+        Stream.name.label('stream_name')
+    ).join(Class, Student.class_id == Class.id) \
+        .outerjoin(Stream, Student.stream_id == Stream.id) \
+        .filter(Student.is_active == True)
+
+    # Prefix matches come first; substring matches (e.g. "1001" in "SM/1001") fill any
+    # remaining slots and use the trigram index on PostgreSQL
+    students = search_query.filter(or_(
+        Student.admission_no.istartswith(query),
+        Student.first_name.istartswith(query),
+        Student.last_name.istartswith(query)
+    )).limit(10).all()
+    if len(students) < 10:
+        students += search_query.filter(
+            or_(
+                Student.admission_no.icontains(query),
+                Student.first_name.icontains(query),
+                Student.last_name.icontains(query)
+            ),
+            Student.id.notin_([s.id for s in students])
+        ).limit(10 - len(students)).all()
 
     return jsonify([{
         'id': s.id,
         'admission_no': s.admission_no,
-        'name': s.full_name,
-        'class': f"{s.class_obj.name}{'-' + s.stream.name if s.stream else ''}"
+        'name': s.name,
+        'class': f"{s.class_name}{'-' + s.stream_name if s.stream_name else ''}"
     } for s in students])
 
 
@@ -1814,29 +2218,35 @@ def edit_class(class_id):
 @login_required
 def delete_class(class_id):
     class_obj = Class.query.get_or_404(class_id)
+    class_name = class_obj.name
 
-    # Check if class has students
-    student_count = Student.query.filter_by(class_id=class_id, is_active=True).count()
-    if student_count > 0:
-        flash(f'Cannot delete class {class_obj.name} - it has {student_count} active students', 'error')
+    # The RESTRICT foreign keys reject the delete while anything still references the class
+    try:
+        db.session.delete(class_obj)
+        db.session.commit()
+        flash(f'Class {class_name} deleted successfully', 'success')
         return redirect(url_for('academic_management'))
+    except IntegrityError:
+        db.session.rollback()
 
-    # Check if class has streams
-    stream_count = Stream.query.filter_by(class_id=class_id).count()
-    if stream_count > 0:
-        flash(f'Cannot delete class {class_obj.name} - it has {stream_count} streams. Delete streams first.', 'error')
-        return redirect(url_for('academic_management'))
+    # Work out what is blocking the delete only once it has been refused
+    student_count, stream_count, referencing_count = db.session.query(
+        db.session.query(func.count(Student.id)).filter_by(class_id=class_id).scalar_subquery(),
+        db.session.query(func.count(Stream.id)).filter_by(class_id=class_id).scalar_subquery(),
+        db.session.query(func.count(Class.id)).filter_by(next_class_id=class_id).scalar_subquery()
+    ).one()
 
-    # Check if class is referenced as next_class by other classes
-    referencing_classes = Class.query.filter_by(next_class_id=class_id).all()
-    if referencing_classes:
+    if student_count > 0:
+        flash(f'Cannot delete class {class_name} - it has {student_count} students', 'error')
+    elif stream_count > 0:
+        flash(f'Cannot delete class {class_name} - it has {stream_count} streams. Delete streams first.', 'error')
+    elif referencing_count > 0:
+        referencing_classes = Class.query.filter_by(next_class_id=class_id).all()
         class_names = ', '.join([c.name for c in referencing_classes])
-        flash(f'Cannot delete class {class_obj.name} - it is set as the next class for: {class_names}', 'error')
-        return redirect(url_for('academic_management'))
+        flash(f'Cannot delete class {class_name} - it is set as the next class for: {class_names}', 'error')
+    else:
+        flash(f'Cannot delete class {class_name} - it is still referenced by fee rates or promotions', 'error')
 
-    db.session.delete(class_obj)
-    db.session.commit()
-    flash(f'Class {class_obj.name} deleted successfully', 'success')
     return redirect(url_for('academic_management'))
 
 
@@ -1863,20 +2273,25 @@ def edit_stream(stream_id):
 @login_required
 def delete_stream(stream_id):
     stream = Stream.query.get_or_404(stream_id)
+    class_name = stream.class_obj.name
+    stream_name = stream.name
 
-    # Check if stream has students
-    student_count = Student.query.filter_by(stream_id=stream_id, is_active=True).count()
-    if student_count > 0:
-        flash(f'Cannot delete stream {stream.class_obj.name}-{stream.name} - it has {student_count} active students',
-              'error')
+    # The RESTRICT foreign keys reject the delete while anything still references the stream
+    try:
+        db.session.delete(stream)
+        db.session.commit()
+        flash(f'Stream {class_name}-{stream_name} deleted successfully', 'success')
         return redirect(url_for('academic_management'))
+    except IntegrityError:
+        db.session.rollback()
 
-    class_name = stream.class_obj.name
-    stream_name = stream.name
+    student_count = Student.query.filter_by(stream_id=stream_id).count()
+    if student_count > 0:
+        flash(f'Cannot delete stream {class_name}-{stream_name} - it has {student_count} students', 'error')
+    else:
+        flash(f'Cannot delete stream {class_name}-{stream_name} - it is still referenced by fee rates or promotions',
+              'error')
 
-    db.session.delete(stream)
-    db.session.commit()
-    flash(f'Stream {class_name}-{stream_name} deleted successfully', 'success')
     return redirect(url_for('academic_management'))
 
 
@@ -1890,15 +2305,19 @@ def edit_academic_year(year_id):
 
     if request.method == 'POST':
         academic_year.year = int(request.form['year'])
-        academic_year.start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
-        academic_year.end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
+        academic_year.start_date = date.fromisoformat(request.form['start_date'])
+        academic_year.end_date = date.fromisoformat(request.form['end_date'])
 
         # Handle current year setting
         is_current = bool(request.form.get('is_current'))
         if is_current and not academic_year.is_current:
-            # Unset other current years
-            AcademicYear.query.update({'is_current': False})
-            academic_year.is_current = True
+            # Flip this year on and the previous current year off in one statement
+            AcademicYear.query.filter(
+                or_(AcademicYear.is_current == True, AcademicYear.id == academic_year.id)
+            ).update(
+                {'is_current': case((AcademicYear.id == academic_year.id, True), else_=False)},
+                synchronize_session=False
+            )
         elif not is_current and academic_year.is_current:
             academic_year.is_current = False
 
@@ -1914,29 +2333,39 @@ def edit_academic_year(year_id):
 def delete_academic_year(year_id):
     academic_year = AcademicYear.query.get_or_404(year_id)
 
+    # Gather all dependency counts in a single round trip
+    assessment_count, rate_count, promotion_count = db.session.query(
+        db.session.query(func.count(FeeAssessment.id)).filter_by(year=academic_year.year).scalar_subquery(),
+        db.session.query(func.count(FeeRate.id)).filter_by(year=academic_year.year).scalar_subquery(),
+        db.session.query(func.count(StudentPromotion.id))
+        .filter_by(academic_year=academic_year.year).scalar_subquery()
+    ).one()
+
     # Check if year has fee assessments
-    assessment_count = FeeAssessment.query.filter_by(year=academic_year.year).count()
     if assessment_count > 0:
         flash(f'Cannot delete academic year {academic_year.year} - it has {assessment_count} fee assessments', 'error')
         return redirect(url_for('academic_management'))
 
     # Check if year has fee rates
-    rate_count = FeeRate.query.filter_by(year=academic_year.year).count()
     if rate_count > 0:
         flash(f'Cannot delete academic year {academic_year.year} - it has {rate_count} fee rates', 'error')
         return redirect(url_for('academic_management'))
 
     # Check if year has student promotions
-    promotion_count = StudentPromotion.query.filter_by(academic_year=academic_year.year).count()
     if promotion_count > 0:
         flash(f'Cannot delete academic year {academic_year.year} - it has {promotion_count} student promotions',
               'error')
         return redirect(url_for('academic_management'))
 
     year_value = academic_year.year
-    db.session.delete(academic_year)
-    db.session.commit()
-    flash(f'Academic year {year_value} deleted successfully', 'success')
+    try:
+        db.session.delete(academic_year)
+        db.session.commit()
+        flash(f'Academic year {year_value} deleted successfully', 'success')
+    except IntegrityError:
+        db.session.rollback()
+        flash(f'Cannot delete academic year {year_value} - it is still referenced by other records', 'error')
+
     return redirect(url_for('academic_management'))
 
 
@@ -1949,28 +2378,22 @@ def edit_student(student_id):
     student = Student.query.get_or_404(student_id)
 
     if request.method == 'POST':
-        student.admission_no = request.form['admission_no']
-        student.first_name = request.form['first_name']
-        student.last_name = request.form['last_name']
-        student.date_of_birth = datetime.strptime(request.form['date_of_birth'], '%Y-%m-%d').date() if request.form[
-            'date_of_birth'] else None
-        student.class_id = int(request.form['class_id'])
-        student.stream_id = int(request.form['stream_id']) if request.form['stream_id'] else None
-        student.student_type = StudentType(request.form['student_type'])
-        student.parent_name = request.form['parent_name']
-        student.parent_phone = request.form['parent_phone']
-        student.parent_email = request.form['parent_email']
-        student.vehicle_id = int(request.form['vehicle_id']) if request.form['vehicle_id'] else None
-        student.transport_distance_km = Decimal(request.form['transport_distance_km']) if request.form[
-            'transport_distance_km'] else None
+        try:
+            values = student_form_values(request.form)
+        except ValueError as e:
+            flash(f'Invalid student details: {e}', 'error')
+            return redirect(request.url)
+
+        for key, value in values.items():
+            setattr(student, key, value)
 
         db.session.commit()
         flash('Student updated successfully', 'success')
         return redirect(url_for('student_detail', student_id=student_id))
 
-    classes = Class.query.all()
-    streams = Stream.query.filter_by(class_id=student.class_id).all()
-    vehicles = Vehicle.query.filter_by(is_active=True).all()
+    classes = get_all_classes()
+    streams = get_stream_options(student.class_id)
+    vehicles = get_active_vehicles()
 
     return render_template('students/edit.html',
                            student=student,
@@ -1984,33 +2407,38 @@ def edit_student(student_id):
 def delete_student(student_id):
     student = Student.query.get_or_404(student_id)
 
+    # All four guards are answered by one round trip; each EXISTS stops at its first match
+    payments = Payment.query.filter_by(student_id=student_id)
+    assessments = FeeAssessment.query.filter_by(student_id=student_id)
+    promotions = StudentPromotion.query.filter_by(student_id=student_id)
+    assignments = StudentFeeAssignment.query.filter_by(student_id=student_id)
+    has_payments, has_assessments, has_promotions, has_assignments = db.session.query(
+        payments.exists(), assessments.exists(), promotions.exists(), assignments.exists()
+    ).one()
+
     # Check if student has payments
-    payment_count = Payment.query.filter_by(student_id=student_id).count()
-    if payment_count > 0:
+    if has_payments:
         flash(
-            f'Cannot delete student {student.full_name} - they have {payment_count} payment records. Consider deactivating instead.',
+            f'Cannot delete student {student.full_name} - they have {payments.count()} payment records. Consider deactivating instead.',
             'error')
         return redirect(url_for('student_detail', student_id=student_id))
 
     # Check if student has fee assessments
-    assessment_count = FeeAssessment.query.filter_by(student_id=student_id).count()
-    if assessment_count > 0:
+    if has_assessments:
         flash(
-            f'Cannot delete student {student.full_name} - they have {assessment_count} fee assessments. Consider deactivating instead.',
+            f'Cannot delete student {student.full_name} - they have {assessments.count()} fee assessments. Consider deactivating instead.',
             'error')
         return redirect(url_for('student_detail', student_id=student_id))
 
     # Check if student has promotions
-    promotion_count = StudentPromotion.query.filter_by(student_id=student_id).count()
-    if promotion_count > 0:
+    if has_promotions:
         flash(
             f'Cannot delete student {student.full_name} - they have promotion records. Consider deactivating instead.',
             'error')
         return redirect(url_for('student_detail', student_id=student_id))
 
     # Check if student has individual fee assignments
-    assignment_count = StudentFeeAssignment.query.filter_by(student_id=student_id).count()
-    if assignment_count > 0:
+    if has_assignments:
         flash(
             f'Cannot delete student {student.full_name} - they have individual fee assignments. Consider deactivating instead.',
             'error')
@@ -2028,10 +2456,10 @@ def delete_student(student_id):
 @app.route('/students/deactivate/<int:student_id>', methods=['POST'])
 @login_required
 def deactivate_student(student_id):
-    student = Student.query.get_or_404(student_id)
+    # Only the name is needed for the message; the flag is flipped with a direct UPDATE
+    student = Student.query.with_entities(Student.full_name).filter_by(id=student_id).first_or_404()
 
-    student.is_active = False
-    student.deactivation_date = date.today()
+    Student.query.filter_by(id=student_id).update({'is_active': False}, synchronize_session=False)
 
     db.session.commit()
     flash(f'Student {student.full_name} deactivated successfully', 'success')
@@ -2041,10 +2469,9 @@ def deactivate_student(student_id):
 @app.route('/students/reactivate/<int:student_id>', methods=['POST'])
 @login_required
 def reactivate_student(student_id):
-    student = Student.query.get_or_404(student_id)
+    student = Student.query.with_entities(Student.full_name).filter_by(id=student_id).first_or_404()
 
-    student.is_active = True
-    student.deactivation_date = None
+    Student.query.filter_by(id=student_id).update({'is_active': True}, synchronize_session=False)
 
     db.session.commit()
     flash(f'Student {student.full_name} reactivated successfully', 'success')
@@ -2083,11 +2510,14 @@ def edit_fee_item(item_id):
         }
 
     if request.method == 'POST':
-        fee_item.name = request.form['name']
-        fee_item.code = request.form['code'].upper()
-        fee_item.description = request.form['description']
-        fee_item.scope = FeeScope(request.form['scope'])
-        fee_item.is_per_km = bool(request.form.get('is_per_km'))
+        try:
+            values = fee_item_form_values(request.form)
+        except ValueError as e:
+            flash(f'Invalid fee item details: {e}', 'error')
+            return redirect(request.url)
+
+        for key, value in values.items():
+            setattr(fee_item, key, value)
 
         db.session.commit()
         flash('Fee item updated successfully', 'success')
@@ -2104,22 +2534,22 @@ def edit_fee_item(item_id):
 def delete_fee_item(item_id):
     fee_item = FeeItem.query.get_or_404(item_id)
 
-    # Check if fee item has assessments
-    assessment_count = FeeAssessment.query.filter_by(fee_item_id=item_id).count()
-    if assessment_count > 0:
-        flash(f'Cannot delete fee item {fee_item.name} - it has {assessment_count} assessments', 'error')
+    # Each guard stops at the first matching row; counts are only taken for the message
+    assessments = FeeAssessment.query.filter_by(fee_item_id=item_id)
+    if db.session.query(assessments.exists()).scalar():
+        flash(f'Cannot delete fee item {fee_item.name} - it has {assessments.count()} assessments', 'error')
         return redirect(url_for('fee_management'))
 
     # Check if fee item has rates
-    rate_count = FeeRate.query.filter_by(fee_item_id=item_id).count()
-    if rate_count > 0:
-        flash(f'Cannot delete fee item {fee_item.name} - it has {rate_count} fee rates', 'error')
+    rates = FeeRate.query.filter_by(fee_item_id=item_id)
+    if db.session.query(rates.exists()).scalar():
+        flash(f'Cannot delete fee item {fee_item.name} - it has {rates.count()} fee rates', 'error')
         return redirect(url_for('fee_management'))
 
     # Check if fee item has individual assignments
-    assignment_count = StudentFeeAssignment.query.filter_by(fee_item_id=item_id).count()
-    if assignment_count > 0:
-        flash(f'Cannot delete fee item {fee_item.name} - it has {assignment_count} individual assignments', 'error')
+    assignments = StudentFeeAssignment.query.filter_by(fee_item_id=item_id)
+    if db.session.query(assignments.exists()).scalar():
+        flash(f'Cannot delete fee item {fee_item.name} - it has {assignments.count()} individual assignments', 'error')
         return redirect(url_for('fee_management'))
 
     fee_item_name = fee_item.name
@@ -2177,14 +2607,14 @@ def edit_fee_rate(rate_id):
         }
 
     if request.method == 'POST':
-        fee_rate.fee_item_id = int(request.form['fee_item_id'])
-        fee_rate.term = int(request.form['term'])
-        fee_rate.year = int(request.form['year'])
-        fee_rate.class_id = int(request.form['class_id']) if request.form['class_id'] else None
-        fee_rate.stream_id = int(request.form['stream_id']) if request.form['stream_id'] else None
-        fee_rate.student_type = StudentType(request.form['student_type']) if request.form['student_type'] else None
-        fee_rate.amount = Decimal(request.form['amount']) if request.form['amount'] else None
-        fee_rate.rate_per_km = Decimal(request.form['rate_per_km']) if request.form['rate_per_km'] else None
+        try:
+            values = fee_rate_form_values(request.form)
+        except ValueError as e:
+            flash(f'Invalid fee rate details: {e}', 'error')
+            return redirect(request.url)
+
+        for key, value in values.items():
+            setattr(fee_rate, key, value)
         fee_rate.is_active = bool(request.form.get('is_active'))
 
         db.session.commit()
@@ -2192,7 +2622,7 @@ def edit_fee_rate(rate_id):
         return redirect(url_for('fee_management'))
 
     fee_items = FeeItem.query.filter_by(is_active=True).all()
-    classes = Class.query.all()
+    classes = get_all_classes()
 
     return render_template('fees/edit_rate.html',
                            fee_rate=fee_rate,
@@ -2208,13 +2638,13 @@ def delete_fee_rate(rate_id):
     fee_rate = FeeRate.query.get_or_404(rate_id)
 
     # Check if rate has been used in assessments
-    assessment_count = db.session.query(FeeAssessment) \
+    assessments = FeeAssessment.query \
         .filter_by(fee_item_id=fee_rate.fee_item_id) \
-        .filter_by(term=fee_rate.term, year=fee_rate.year).count()
+        .filter_by(term=fee_rate.term, year=fee_rate.year)
 
-    if assessment_count > 0:
+    if db.session.query(assessments.exists()).scalar():
         flash(
-            f'Cannot delete fee rate - it has been used in {assessment_count} assessments. Consider deactivating instead.',
+            f'Cannot delete fee rate - it has been used in {assessments.count()} assessments. Consider deactivating instead.',
             'error')
         return redirect(url_for('fee_management'))
 
@@ -2253,7 +2683,7 @@ def edit_student_assignment(assignment_id):
         return redirect(url_for('student_detail', student_id=student.id))
 
     fee_items = FeeItem.query.filter_by(is_active=True).all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    current_year = get_current_academic_year()
 
     return render_template('fees/edit_assignment.html',
                            assignment=assignment,
@@ -2317,46 +2747,27 @@ def get_standard_rate():
             scope_description = "All students"
 
         elif fee_item.scope == FeeScope.STREAM_LEVEL and student.stream_id:
-            rate = FeeRate.query.filter_by(
-                fee_item_id=fee_item_id,
-                term=term,
-                year=year,
-                stream_id=student.stream_id,
-                student_type=student.student_type,
-                is_active=True
-            ).first()
-
-            if not rate:
-                rate = FeeRate.query.filter_by(
-                    fee_item_id=fee_item_id,
-                    term=term,
-                    year=year,
-                    stream_id=student.stream_id,
-                    student_type=None,
-                    is_active=True
-                ).first()
+            # Prefer the rate for the student's type, falling back to the untyped rate
+            rate = FeeRate.query.filter(
+                FeeRate.fee_item_id == fee_item_id,
+                FeeRate.term == term,
+                FeeRate.year == year,
+                FeeRate.stream_id == student.stream_id,
+                or_(FeeRate.student_type == student.student_type, FeeRate.student_type.is_(None)),
+                FeeRate.is_active == True
+            ).order_by(FeeRate.student_type.is_(None), FeeRate.id).first()
 
             scope_description = f"{student.class_obj.name}-{student.stream.name}"
 
         elif fee_item.scope == FeeScope.CLASS_LEVEL:
-            rate = FeeRate.query.filter_by(
-                fee_item_id=fee_item_id,
-                term=term,
-                year=year,
-                class_id=student.class_id,
-                student_type=student.student_type,
-                is_active=True
-            ).first()
-
-            if not rate:
-                rate = FeeRate.query.filter_by(
-                    fee_item_id=fee_item_id,
-                    term=term,
-                    year=year,
-                    class_id=student.class_id,
-                    student_type=None,
-                    is_active=True
-                ).first()
+            rate = FeeRate.query.filter(
+                FeeRate.fee_item_id == fee_item_id,
+                FeeRate.term == term,
+                FeeRate.year == year,
+                FeeRate.class_id == student.class_id,
+                or_(FeeRate.student_type == student.student_type, FeeRate.student_type.is_(None)),
+                FeeRate.is_active == True
+            ).order_by(FeeRate.student_type.is_(None), FeeRate.id).first()
 
             scope_description = student.class_obj.name
 
@@ -2425,8 +2836,8 @@ def assess_fees_with_preview():
 
             return redirect(url_for('fee_management'))
 
-    classes = Class.query.all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    classes = get_all_classes()
+    current_year = get_current_academic_year()
 
     return render_template('fees/assess.html',
                            classes=classes,
@@ -2452,11 +2863,9 @@ def handle_fee_assessment_preview():
         elif assessment_scope == 'individual' and request.form.get('student_id'):
             query = query.filter_by(id=int(request.form['student_id']))
 
-        students = query.all()
-
         # Simulate assessment generation
         preview_data = {
-            'students_count': len(students),
+            'students_count': query.count(),
             'assessments_count': 0,
             'total_amount': 'KSh 0.00',
             'skipped_count': 0,
@@ -2466,22 +2875,47 @@ def handle_fee_assessment_preview():
 
         total_amount = Decimal('0')
         fee_totals = {}
-
-        for student in students:
-            # Check existing assessments if skip_existing is enabled
-            if skip_existing:
-                existing = FeeAssessment.query.filter_by(
-                    student_id=student.id,
-                    term=term,
-                    year=year
-                ).first()
-
-                if existing:
-                    preview_data['skipped_count'] += 1
-                    continue
-
-            # Get applicable fees for this student
-            applicable_fees = get_applicable_fees_for_student(student, term, year)
+        rate_index = build_rate_index(term, year)
+        assignment_index = build_assignment_index(term, year)
+        fee_items = FeeItem.query.filter_by(is_active=True).all()
+        profile_cache = {}
+
+        # Students already assessed for this term are left out of the pricing
+        target_query = query
+        if skip_existing:
+            assessed = db.session.query(FeeAssessment.student_id).filter(
+                FeeAssessment.term == term,
+                FeeAssessment.year == year
+            )
+            preview_data['skipped_count'] = query.filter(Student.id.in_(assessed)).count()
+            target_query = query.filter(Student.id.notin_(assessed))
+
+        # Students with individual assignments are priced one by one. Everyone else is
+        # charged purely by fee profile, so the database groups them and each profile
+        # is priced once for its head count. Any member id stands in for the group
+        # since none of them has an individual assignment.
+        assigned = db.session.query(StudentFeeAssignment.student_id).filter(
+            StudentFeeAssignment.term == term,
+            StudentFeeAssignment.year == year,
+            StudentFeeAssignment.is_active == True
+        )
+        priced_groups = [(student, 1) for student in
+                         with_fee_columns(target_query.filter(Student.id.in_(assigned))).all()]
+        profile_columns = (Student.class_id, Student.stream_id, Student.student_type,
+                           Student.transport_distance_km, Student.vehicle_id.isnot(None))
+        priced_groups += [(profile, profile.students) for profile in target_query.filter(
+            Student.id.notin_(assigned)
+        ).with_entities(
+            func.min(Student.id).label('id'),
+            *profile_columns[:4],
+            profile_columns[4].label('vehicle_id'),
+            func.count(Student.id).label('students')
+        ).group_by(*profile_columns)]
+
+        for student, head_count in priced_groups:
+            # Get applicable fees for this student (or group of identical students)
+            applicable_fees = get_applicable_fees_for_student(
+                student, term, year, rate_index, assignment_index, fee_items, profile_cache)
 
             for fee_item, rate_info in applicable_fees:
                 # Skip transport fees if not included
@@ -2491,8 +2925,8 @@ def handle_fee_assessment_preview():
                 amount = calculate_fee_amount(student, fee_item, rate_info)
 
                 if amount > 0:
-                    preview_data['assessments_count'] += 1
-                    total_amount += amount
+                    preview_data['assessments_count'] += head_count
+                    total_amount += amount * head_count
 
                     # Track fee breakdown
                     if fee_item.code not in fee_totals:
@@ -2503,11 +2937,11 @@ def handle_fee_assessment_preview():
                             'amount': Decimal('0')
                         }
 
-                    fee_totals[fee_item.code]['students_count'] += 1
-                    fee_totals[fee_item.code]['amount'] += amount
+                    fee_totals[fee_item.code]['students_count'] += head_count
+                    fee_totals[fee_item.code]['amount'] += amount * head_count
 
-        # Format fee breakdown
-        for code, data in fee_totals.items():
+        # Format fee breakdown, listed in fee item order
+        for data in (fee_totals[item.code] for item in fee_items if item.code in fee_totals):
             preview_data['fee_breakdown'].append({
                 'code': data['code'],
                 'name': data['name'],
@@ -2522,7 +2956,7 @@ def handle_fee_assessment_preview():
             preview_data['warnings'].append('No new assessments will be created with the current criteria.')
 
         if not include_transport:
-            transport_students = sum(1 for s in students if s.vehicle_id)
+            transport_students = query.filter(Student.vehicle_id.isnot(None)).count()
             if transport_students > 0:
                 preview_data['warnings'].append(
                     f'{transport_students} students have transport assignments but transport fees are excluded.')
@@ -2578,58 +3012,6 @@ def student_payments(student_id):
                            balance_summary=balance_summary)
 
 
-
-def amount_to_words(amount):
-    """Convert amount to words for receipt"""
-    amount = float(amount)
-    shillings = int(amount)
-    cents = int((amount - shillings) * 100)
-
-    ones = ['', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine']
-    tens = ['', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety']
-    teens = ['Ten', 'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen', 'Seventeen', 'Eighteen',
-             'Nineteen']
-
-    def convert_below_thousand(n):
-        if n == 0:
-            return ''
-        elif n < 10:
-            return ones[n]
-        elif n < 20:
-            return teens[n - 10]
-        elif n < 100:
-            return tens[n // 10] + (' ' + ones[n % 10] if n % 10 != 0 else '')
-        else:
-            return ones[n // 100] + ' Hundred' + (' ' + convert_below_thousand(n % 100) if n % 100 != 0 else '')
-
-    if shillings == 0:
-        words = 'Zero Shillings'
-    else:
-        words = ''
-
-        # Millions
-        if shillings >= 1000000:
-            words += convert_below_thousand(shillings // 1000000) + ' Million '
-            shillings %= 1000000
-
-        # Thousands
-        if shillings >= 1000:
-            words += convert_below_thousand(shillings // 1000) + ' Thousand '
-            shillings %= 1000
-
-        # Remaining
-        if shillings > 0:
-            words += convert_below_thousand(shillings)
-
-        words = words.strip() + ' Shillings'
-
-    if cents > 0:
-        words += ' and ' + convert_below_thousand(cents) + ' Cents'
-
-    return words
-
-
-
 @app.route('/fees/rates')
 @login_required
 def fee_rates_list():
@@ -2657,8 +3039,8 @@ def fee_rates_list():
 
     current_rates = query.all()
     fee_items = FeeItem.query.filter_by(is_active=True).all()
-    classes = Class.query.all()
-    current_year = AcademicYear.query.filter_by(is_current=True).first()
+    classes = get_all_classes()
+    current_year = get_current_academic_year()
 
     return render_template('fees/rates_list.html',
                            current_rates=current_rates,
@@ -2677,44 +3059,65 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from reportlab.graphics.shapes import Drawing, Circle, String
 from decimal import Decimal
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+
+
+AMOUNT_WORD_ONES = ('', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine')
+AMOUNT_WORD_TENS = ('', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety')
+AMOUNT_WORD_TEENS = ('Ten', 'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen', 'Seventeen',
+                     'Eighteen', 'Nineteen')
+AMOUNT_WORD_SCALES = ((1000000, 'Million'), (1000, 'Thousand'))
+
+
+def _below_hundred_words(n):
+    """Words for 0-99, used once to build AMOUNT_WORDS_BELOW_100"""
+    if n < 10:
+        return AMOUNT_WORD_ONES[n]
+    if n < 20:
+        return AMOUNT_WORD_TEENS[n - 10]
+    return AMOUNT_WORD_TENS[n // 10] + (' ' + AMOUNT_WORD_ONES[n % 10] if n % 10 != 0 else '')
+
+
+# Every 0-99 phrase is built at import, so converting a number is a couple of lookups
+AMOUNT_WORDS_BELOW_100 = tuple(_below_hundred_words(n) for n in range(100))
+
+
+def convert_below_thousand(n):
+    """Words for 0-999, empty for zero"""
+    hundreds, rest = divmod(n, 100)
+    if not hundreds:
+        return AMOUNT_WORDS_BELOW_100[rest]
+
+    parts = [AMOUNT_WORD_ONES[hundreds], 'Hundred']
+    if rest:
+        parts.append(AMOUNT_WORDS_BELOW_100[rest])
+    return ' '.join(parts)
 
 
 def amount_to_words(amount):
     """Convert amount to words"""
-    amount = float(amount)
+    return _amount_to_words(float(amount))
+
+
+@lru_cache(maxsize=2048)
+def _amount_to_words(amount):
+    """amount_to_words() for a float amount; receipts repeat the same fee totals, so results are memoised"""
     shillings = int(amount)
     cents = int((amount - shillings) * 100)
 
-    ones = ['', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine']
-    tens = ['', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety']
-    teens = ['Ten', 'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen', 'Seventeen', 'Eighteen',
-             'Nineteen']
-
-    def convert_below_thousand(n):
-        if n == 0:
-            return ''
-        elif n < 10:
-            return ones[n]
-        elif n < 20:
-            return teens[n - 10]
-        elif n < 100:
-            return tens[n // 10] + (' ' + ones[n % 10] if n % 10 != 0 else '')
-        else:
-            return ones[n // 100] + ' Hundred' + (' ' + convert_below_thousand(n % 100) if n % 100 != 0 else '')
-
     if shillings == 0:
         words = 'Zero'
     else:
-        words = ''
-        if shillings >= 1000000:
-            words += convert_below_thousand(shillings // 1000000) + ' Million '
-            shillings %= 1000000
-        if shillings >= 1000:
-            words += convert_below_thousand(shillings // 1000) + ' Thousand '
-            shillings %= 1000
+        parts = []
+        for scale, scale_name in AMOUNT_WORD_SCALES:
+            if shillings >= scale:
+                parts.append(convert_below_thousand(shillings // scale) + ' ' + scale_name)
+                shillings %= scale
         if shillings > 0:
-            words += convert_below_thousand(shillings)
-        words = words.strip()
+            parts.append(convert_below_thousand(shillings))
+        words = ' '.join(parts)
 
     if cents > 0:
         words += ' and ' + convert_below_thousand(cents) + ' Cents'
@@ -2722,8 +3125,99 @@ def amount_to_words(amount):
     return words
 
 
-def generate_receipt_pdf(payment):
-    """Generate simple PDF receipt matching the image style"""
+def student_allocation_totals(student_id):
+    """Total assessed and total allocated for a student, fetched in one round trip"""
+    total_assessed, total_paid = db.session.query(
+        db.session.query(func.sum(FeeAssessment.amount))
+        .filter(FeeAssessment.student_id == student_id).scalar_subquery(),
+        db.session.query(func.sum(PaymentAllocation.amount))
+        .join(FeeAssessment)
+        .filter(FeeAssessment.student_id == student_id).scalar_subquery()
+    ).one()
+    return Decimal(str(total_assessed or 0)), Decimal(str(total_paid or 0))
+
+
+# Receipt styles never change between payments, so they are built once at import
+RECEIPT_STYLES = getSampleStyleSheet()
+
+RECEIPT_SCHOOL_NAME_STYLE = ParagraphStyle(
+    'SchoolName',
+    parent=RECEIPT_STYLES['Heading1'],
+    fontSize=18,
+    alignment=TA_CENTER,
+    spaceAfter=3,
+    fontName='Helvetica-Bold'
+)
+
+RECEIPT_SCHOOL_INFO_STYLE = ParagraphStyle(
+    'SchoolInfo',
+    parent=RECEIPT_STYLES['Normal'],
+    fontSize=10,
+    alignment=TA_CENTER,
+    spaceAfter=2
+)
+
+RECEIPT_TITLE_STYLE = ParagraphStyle(
+    'Title',
+    parent=RECEIPT_STYLES['Heading2'],
+    fontSize=14,
+    alignment=TA_CENTER,
+    spaceAfter=8,
+    spaceBefore=8,
+    fontName='Helvetica-Bold'
+)
+
+RECEIPT_AMOUNT_STYLE = ParagraphStyle('Amount', fontSize=10, spaceAfter=5)
+
+RECEIPT_HEADER_LINE_STYLE = TableStyle([
+    ('LINEBELOW', (0, 0), (-1, -1), 2, colors.black),
+])
+
+RECEIPT_DETAILS_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (2, 0), (2, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (2, 2), (2, 2), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('FONTNAME', (1, 1), (1, 1), 'Helvetica-Bold'),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+])
+
+RECEIPT_FEE_TABLE_STYLE = TableStyle([
+    # Header
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    # Last two rows bold
+    ('BACKGROUND', (0, -2), (-1, -1), colors.lightgrey),
+    ('FONTNAME', (0, -2), (-1, -1), 'Helvetica-Bold'),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+])
+
+RECEIPT_FOOTER_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('TOPPADDING', (0, 0), (-1, -1), 3),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
+    ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+    ('ALIGN', (3, 0), (3, -1), 'RIGHT'),
+])
+
+RECEIPT_FOOTER_LINE_STYLE = TableStyle([
+    ('LINEABOVE', (0, 0), (-1, -1), 1, colors.black),
+])
+
+
+def generate_receipt_pdf(payment, allocation_totals=None):
+    """Generate simple PDF receipt matching the image style, returned as bytes
+
+    Args:
+        allocation_totals: Optional result of student_allocation_totals() for the
+            payment's student, when the caller has already fetched it
+    """
     buffer = BytesIO()
 
     doc = SimpleDocTemplate(buffer, pagesize=A5,
@@ -2731,35 +3225,6 @@ def generate_receipt_pdf(payment):
                             topMargin=10 * mm, bottomMargin=10 * mm)
 
     elements = []
-    styles = getSampleStyleSheet()
-
-    # Custom styles
-    school_name_style = ParagraphStyle(
-        'SchoolName',
-        parent=styles['Heading1'],
-        fontSize=18,
-        alignment=TA_CENTER,
-        spaceAfter=3,
-        fontName='Helvetica-Bold'
-    )
-
-    school_info_style = ParagraphStyle(
-        'SchoolInfo',
-        parent=styles['Normal'],
-        fontSize=10,
-        alignment=TA_CENTER,
-        spaceAfter=2
-    )
-
-    title_style = ParagraphStyle(
-        'Title',
-        parent=styles['Heading2'],
-        fontSize=14,
-        alignment=TA_CENTER,
-        spaceAfter=8,
-        spaceBefore=8,
-        fontName='Helvetica-Bold'
-    )
 
     # Header with logo
     header_table_data = [['']]
@@ -2779,22 +3244,20 @@ def generate_receipt_pdf(payment):
     elements.append(logo_drawing)
 
     # School name and details
-    elements.append(Paragraph("ST LUKE MOGOBICH ACADEMY", school_name_style))
-    elements.append(Paragraph("P.O. BOX 1234-00100, Nairobi.", school_info_style))
-    elements.append(Paragraph("Tel: 0706 950 210 / 0701 693 009", school_info_style))
-    elements.append(Paragraph("Email: stlukemogobich@gmail.com", school_info_style))
-    elements.append(Paragraph("<b>Chokaa- Utawala Road</b>", school_info_style))
+    elements.append(Paragraph("ST LUKE MOGOBICH ACADEMY", RECEIPT_SCHOOL_NAME_STYLE))
+    elements.append(Paragraph("P.O. BOX 1234-00100, Nairobi.", RECEIPT_SCHOOL_INFO_STYLE))
+    elements.append(Paragraph("Tel: 0706 950 210 / 0701 693 009", RECEIPT_SCHOOL_INFO_STYLE))
+    elements.append(Paragraph("Email: stlukemogobich@gmail.com", RECEIPT_SCHOOL_INFO_STYLE))
+    elements.append(Paragraph("<b>Chokaa- Utawala Road</b>", RECEIPT_SCHOOL_INFO_STYLE))
 
     # Horizontal line
     line_table = Table([['']], colWidths=[128 * mm], rowHeights=[2])
-    line_table.setStyle(TableStyle([
-        ('LINEBELOW', (0, 0), (-1, -1), 2, colors.black),
-    ]))
+    line_table.setStyle(RECEIPT_HEADER_LINE_STYLE)
     elements.append(Spacer(1, 3 * mm))
     elements.append(line_table)
 
     # Title
-    elements.append(Paragraph("OFFICIAL RECEIPT", title_style))
+    elements.append(Paragraph("OFFICIAL RECEIPT", RECEIPT_TITLE_STYLE))
 
     # Receipt details
     receipt_data = [
@@ -2805,21 +3268,13 @@ def generate_receipt_pdf(payment):
     ]
 
     receipt_table = Table(receipt_data, colWidths=[28 * mm, 40 * mm, 24 * mm, 36 * mm])
-    receipt_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 2), (2, 2), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (1, 1), (1, 1), 'Helvetica-Bold'),
-        ('TOPPADDING', (0, 0), (-1, -1), 4),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-    ]))
+    receipt_table.setStyle(RECEIPT_DETAILS_STYLE)
     elements.append(receipt_table)
     elements.append(Spacer(1, 5 * mm))
 
     # Amount in words
     amount_para = Paragraph(f"<b>Amount..</b> {amount_to_words(payment.amount)} Shillings",
-                            ParagraphStyle('Amount', fontSize=10, spaceAfter=5))
+                            RECEIPT_AMOUNT_STYLE)
     elements.append(amount_para)
     elements.append(Spacer(1, 3 * mm))
 
@@ -2839,33 +3294,17 @@ def generate_receipt_pdf(payment):
     fee_data.append(['PREPAYMENTS', '0.00'])
 
     # Calculate balance
-    total_assessed = db.session.query(db.func.sum(FeeAssessment.amount)) \
-                         .filter_by(student_id=payment.student.id).scalar() or Decimal('0')
-
-    total_paid = db.session.query(db.func.sum(PaymentAllocation.amount)) \
-                     .join(FeeAssessment) \
-                     .filter(FeeAssessment.student_id == payment.student.id).scalar() or Decimal('0')
-
-    current_balance = Decimal(str(total_assessed)) - Decimal(str(total_paid))
+    if allocation_totals is None:
+        allocation_totals = student_allocation_totals(payment.student_id)
+    total_assessed, total_paid = allocation_totals
+    current_balance = total_assessed - total_paid
 
     # Add arrears and total
     fee_data.append(['FEES ARREARS', f"{current_balance:.2f}"])
     fee_data.append(['TOTAL PAID:', f"{payment.amount:.2f}"])
 
     fee_table = Table(fee_data, colWidths=[90 * mm, 38 * mm])
-    fee_table.setStyle(TableStyle([
-        # Header
-        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        # Last two rows bold
-        ('BACKGROUND', (0, -2), (-1, -1), colors.lightgrey),
-        ('FONTNAME', (0, -2), (-1, -1), 'Helvetica-Bold'),
-        ('TOPPADDING', (0, 0), (-1, -1), 4),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-    ]))
+    fee_table.setStyle(RECEIPT_FEE_TABLE_STYLE)
     elements.append(fee_table)
     elements.append(Spacer(1, 5 * mm))
 
@@ -2883,34 +3322,63 @@ def generate_receipt_pdf(payment):
     ]
 
     footer_table = Table(footer_data, colWidths=[28 * mm, 36 * mm, 32 * mm, 32 * mm])
-    footer_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('TOPPADDING', (0, 0), (-1, -1), 3),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
-        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ('ALIGN', (3, 0), (3, -1), 'RIGHT'),
-    ]))
+    footer_table.setStyle(RECEIPT_FOOTER_STYLE)
     elements.append(footer_table)
     elements.append(Spacer(1, 5 * mm))
 
     # Footer note
     line_table2 = Table([['']], colWidths=[128 * mm], rowHeights=[1])
-    line_table2.setStyle(TableStyle([
-        ('LINEABOVE', (0, 0), (-1, -1), 1, colors.black),
-    ]))
+    line_table2.setStyle(RECEIPT_FOOTER_LINE_STYLE)
     elements.append(line_table2)
     elements.append(Spacer(1, 2 * mm))
 
     footer_note = Paragraph(
         "<para align=center><font size=9>Fees once paid is neither Refundable nor Transferrable.</font></para>",
-        styles['Normal']
+        RECEIPT_STYLES['Normal']
     )
     elements.append(footer_note)
 
     doc.build(elements)
-    buffer.seek(0)
-    return buffer
+    # Hand back the buffer's bytes directly; nothing reads the stream again
+    return buffer.getvalue()
+
+
+RECEIPT_PDF_CACHE_SIZE = 256
+_receipt_pdf_cache = OrderedDict()
+_receipt_pdf_lock = threading.Lock()
+
+
+def receipt_pdf_key(payment, allocation_totals):
+    """Everything printed on a receipt PDF, so any change to it renders a fresh one"""
+    student = payment.student
+    return (
+        payment.id, payment.receipt_number, payment.payment_date, payment.amount,
+        payment.payment_mode, payment.mpesa_code, payment.bank_slip_number, payment.cheque_number,
+        payment.processor.name if payment.processor else None,
+        student.full_name, student.admission_no, student.class_obj.name,
+        student.stream.name if student.stream else None,
+        tuple((allocation.assessment.fee_item.name, allocation.amount) for allocation in payment.allocations),
+        allocation_totals
+    )
+
+
+def receipt_pdf_bytes(payment):
+    """Receipt PDF bytes, reusing the last rendering while its content is unchanged"""
+    # Fetched once for both the cache key and, on a miss, the rendering itself
+    allocation_totals = student_allocation_totals(payment.student_id)
+    key = receipt_pdf_key(payment, allocation_totals)
+    with _receipt_pdf_lock:
+        pdf = _receipt_pdf_cache.get(key)
+        if pdf is not None:
+            _receipt_pdf_cache.move_to_end(key)
+            return pdf
+
+    pdf = generate_receipt_pdf(payment, allocation_totals)
+    with _receipt_pdf_lock:
+        _receipt_pdf_cache[key] = pdf
+        if len(_receipt_pdf_cache) > RECEIPT_PDF_CACHE_SIZE:
+            _receipt_pdf_cache.popitem(last=False)
+    return pdf
 
 
 @app.route('/payments/<int:payment_id>/download-pdf')
@@ -2920,9 +3388,7 @@ def download_receipt_pdf(payment_id):
     payment = Payment.query.get_or_404(payment_id)
 
     try:
-        pdf_buffer = generate_receipt_pdf(payment)
-
-        response = make_response(pdf_buffer.getvalue())
+        response = make_response(receipt_pdf_bytes(payment))
         response.headers['Content-Type'] = 'application/pdf'
         response.headers['Content-Disposition'] = f'attachment; filename=Receipt_{payment.receipt_number}.pdf'
 
@@ -2938,17 +3404,12 @@ def download_receipt_pdf(payment_id):
 @login_required
 def payment_detail(payment_id):
     """Display detailed view of a single payment with receipt"""
-    payment = Payment.query.get_or_404(payment_id)
+    payment = Payment.query.options(joinedload(Payment.student)) \
+        .filter_by(id=payment_id).first_or_404()
 
     # Calculate correct balance
-    total_assessed = db.session.query(db.func.sum(FeeAssessment.amount)) \
-                         .filter_by(student_id=payment.student.id).scalar() or Decimal('0')
-
-    total_paid = db.session.query(db.func.sum(PaymentAllocation.amount)) \
-                     .join(FeeAssessment) \
-                     .filter(FeeAssessment.student_id == payment.student.id).scalar() or Decimal('0')
-
-    current_balance = Decimal(str(total_assessed)) - Decimal(str(total_paid))
+    total_assessed, total_paid = student_allocation_totals(payment.student_id)
+    current_balance = total_assessed - total_paid
 
     return render_template('payments/receipt.html',
                            payment=payment,
@@ -2962,17 +3423,12 @@ def payment_detail(payment_id):
 @login_required
 def print_receipt(payment_id):
     """Print-friendly view of receipt"""
-    payment = Payment.query.get_or_404(payment_id)
+    payment = Payment.query.options(joinedload(Payment.student)) \
+        .filter_by(id=payment_id).first_or_404()
 
     # Calculate correct balance
-    total_assessed = db.session.query(db.func.sum(FeeAssessment.amount)) \
-                         .filter_by(student_id=payment.student.id).scalar() or Decimal('0')
-
-    total_paid = db.session.query(db.func.sum(PaymentAllocation.amount)) \
-                     .join(FeeAssessment) \
-                     .filter(FeeAssessment.student_id == payment.student.id).scalar() or Decimal('0')
-
-    current_balance = Decimal(str(total_assessed)) - Decimal(str(total_paid))
+    total_assessed, total_paid = student_allocation_totals(payment.student_id)
+    current_balance = total_assessed - total_paid
 
     return render_template('payments/print_receipt.html',
                            payment=payment,
@@ -2982,49 +3438,6 @@ def print_receipt(payment_id):
                            current_balance=current_balance)
 
 
-def amount_to_words(amount):
-    """Convert amount to words for receipt"""
-    amount = float(amount)
-    shillings = int(amount)
-    cents = int((amount - shillings) * 100)
-
-    ones = ['', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine']
-    tens = ['', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety']
-    teens = ['Ten', 'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen', 'Seventeen', 'Eighteen',
-             'Nineteen']
-
-    def convert_below_thousand(n):
-        if n == 0:
-            return ''
-        elif n < 10:
-            return ones[n]
-        elif n < 20:
-            return teens[n - 10]
-        elif n < 100:
-            return tens[n // 10] + (' ' + ones[n % 10] if n % 10 != 0 else '')
-        else:
-            return ones[n // 100] + ' Hundred' + (' ' + convert_below_thousand(n % 100) if n % 100 != 0 else '')
-
-    if shillings == 0:
-        words = 'Zero'
-    else:
-        words = ''
-        if shillings >= 1000000:
-            words += convert_below_thousand(shillings // 1000000) + ' Million '
-            shillings %= 1000000
-        if shillings >= 1000:
-            words += convert_below_thousand(shillings // 1000) + ' Thousand '
-            shillings %= 1000
-        if shillings > 0:
-            words += convert_below_thousand(shillings)
-        words = words.strip()
-
-    if cents > 0:
-        words += ' and ' + convert_below_thousand(cents) + ' Cents'
-
-    return words
-
-
 # Also add the template filter at the end of your app.py (before if __name__ == '__main__':)
 @app.template_filter('amount_to_words')
 def amount_to_words_filter(amount):
@@ -3229,7 +3642,7 @@ def download_students_by_class():
     ws_summary.append([])
     ws_summary.append(["Class", "Total Students", "Day Students", "Boarders", "Active", "Inactive"])
 
-    classes = Class.query.all()
+    classes = get_all_classes()
     total_students = 0
 
     for class_obj in classes:
@@ -3742,7 +4155,7 @@ def download_student_type_report():
     ws.append(["BREAKDOWN BY CLASS"])
     ws.append(["Class", "Total", "Day Students", "Boarders"])
 
-    classes = Class.query.all()
+    classes = get_all_classes()
     for class_obj in classes:
         total = Student.query.filter_by(class_id=class_obj.id, is_active=True).count()
         day = Student.query.filter_by(class_id=class_obj.id, is_active=True,
@@ -3790,7 +4203,7 @@ def download_vehicle_revenue():
         total_distance = sum(float(s.transport_distance_km or 0) for s in students)
 
         # Calculate potential revenue (simplified - using current year/term 1)
-        current_year = AcademicYear.query.filter_by(is_current=True).first()
+        current_year = get_current_academic_year()
         revenue = 0
 
         if current_year:
@@ -3942,7 +4355,7 @@ def download_class_summary():
     ws.append(["Class", "Streams", "Total Students", "Day Students", "Boarders",
                "With Transport", "Average Balance"])
 
-    classes = Class.query.all()
+    classes = get_all_classes()
 
     for class_obj in classes:
         streams = Stream.query.filter_by(class_id=class_obj.id).count()
@@ -4053,15 +4466,8 @@ def edit_expense(expense_id):
             old_date = expense.expense_date
 
             # Update expense details
-            expense.category_id = int(request.form['category_id'])
-            expense.expense_date = datetime.strptime(request.form['expense_date'], '%Y-%m-%d').date()
-            expense.description = request.form['description']
-            expense.amount = Decimal(request.form['amount'])
-            expense.payment_method = PaymentMode(request.form['payment_method']) if request.form.get(
-                'payment_method') else None
-            expense.reference_number = request.form.get('reference_number')
-            expense.supplier_name = request.form.get('supplier_name')
-            expense.approved_by = request.form.get('approved_by')
+            for key, value in expense_form_values(request.form).items():
+                setattr(expense, key, value)
 
             # Update notes with audit trail
             edit_reason = request.form.get('edit_reason', '')
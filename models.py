@@ -1,12 +1,36 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, inspect, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, make_transient_to_detached
 from datetime import datetime, date
 from decimal import Decimal
 import enum
+import sqlite3
+import time
 
 db = SQLAlchemy()
 
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL journaling so readers are not blocked while receipts are being written"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+@event.listens_for(db.metadata, "before_create")
+def create_trigram_extension(target, connection, **kw):
+    """The PostgreSQL search indexes need pg_trgm before create_all builds them"""
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
 # ===========================
 #  ENUMS FOR BETTER ORGANIZATION
 # ===========================
@@ -86,11 +110,13 @@ class Class(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)  # "Form 1", "Grade 8"
     level = db.Column(db.String(20))  # "Primary", "Secondary"
-    next_class_id = db.Column(db.Integer, db.ForeignKey("classes.id"))  # For automatic promotion
+    next_class_id = db.Column(db.Integer, db.ForeignKey("classes.id", ondelete="RESTRICT"))  # For automatic promotion
 
     # Relationships
     next_class = db.relationship("Class", remote_side=[id])
-    streams = db.relationship("Stream", back_populates="class_obj", cascade="all, delete-orphan")
+    # passive_deletes="all" leaves referencing rows alone so the RESTRICT foreign keys guard deletes
+    streams = db.relationship("Stream", back_populates="class_obj", cascade="save-update, merge",
+                              passive_deletes="all")
 
     def __repr__(self):
         return f"<Class {self.name}>"
@@ -101,13 +127,13 @@ class Stream(db.Model):
     __tablename__ = "streams"
 
     id = db.Column(db.Integer, primary_key=True)
-    class_id = db.Column(db.Integer, db.ForeignKey("classes.id"), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey("classes.id", ondelete="RESTRICT"), nullable=False)
     name = db.Column(db.String(10), nullable=False)  # "A", "B", "C"
     capacity = db.Column(db.Integer, default=40)
 
     # Relationships
     class_obj = db.relationship("Class", back_populates="streams")
-    students = db.relationship("Student", back_populates="stream")
+    students = db.relationship("Student", back_populates="stream", passive_deletes="all")
 
     __table_args__ = (db.UniqueConstraint("class_id", "name", name="unique_class_stream"),)
 
@@ -153,8 +179,8 @@ class Student(db.Model):
     date_of_birth = db.Column(db.Date)
 
     # Current class/stream
-    class_id = db.Column(db.Integer, db.ForeignKey("classes.id"), nullable=False)
-    stream_id = db.Column(db.Integer, db.ForeignKey("streams.id"))
+    class_id = db.Column(db.Integer, db.ForeignKey("classes.id", ondelete="RESTRICT"), nullable=False)
+    stream_id = db.Column(db.Integer, db.ForeignKey("streams.id", ondelete="RESTRICT"))
 
     # Student details
     student_type = db.Column(db.Enum(StudentType), nullable=False)
@@ -171,26 +197,42 @@ class Student(db.Model):
     admission_date = db.Column(db.Date, default=date.today)
 
     # Relationships
-    class_obj = db.relationship("Class", backref="students")
+    class_obj = db.relationship("Class", backref=db.backref("students", passive_deletes="all"))
     stream = db.relationship("Stream", back_populates="students")
     vehicle = db.relationship("Vehicle", back_populates="students")
 
+    __table_args__ = (
+        db.Index("ix_students_class_active", "class_id", "is_active"),
+        db.Index("ix_students_vehicle_active", "vehicle_id", "is_active"),
+        # Trigram index so the LIKE '%term%' payment search can use an index (PostgreSQL only)
+        db.Index("ix_students_search_trgm", "first_name", "last_name", "admission_no",
+                 postgresql_using="gin",
+                 postgresql_ops={"first_name": "gin_trgm_ops", "last_name": "gin_trgm_ops",
+                                 "admission_no": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
     def __repr__(self):
         return f"<Student {self.admission_no} - {self.first_name} {self.last_name}>"
 
-    @property
+    @hybrid_property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
 
+    @full_name.expression
+    def full_name(cls):
+        return cls.first_name + " " + cls.last_name
+
     def get_current_balance(self):
         """Get student's current balance"""
-        total_fees = db.session.query(db.func.sum(FeeAssessment.amount)) \
-                         .filter_by(student_id=self.id).scalar() or 0
-
-        total_payments = db.session.query(db.func.sum(Payment.amount)) \
-                             .filter_by(student_id=self.id).scalar() or 0
+        # Both totals come back in one round trip, each an index lookup on student_id
+        total_fees, total_payments = db.session.query(
+            db.session.query(db.func.sum(FeeAssessment.amount))
+            .filter_by(student_id=self.id).scalar_subquery(),
+            db.session.query(db.func.sum(Payment.amount))
+            .filter_by(student_id=self.id).scalar_subquery()
+        ).one()
 
-        return Decimal(str(total_fees)) - Decimal(str(total_payments))
+        return Decimal(str(total_fees or 0)) - Decimal(str(total_payments or 0))
 
     def promote_to_next_class(self, academic_year, status=PromotionStatus.PROMOTED):
         """Promote student to next class"""
@@ -251,8 +293,8 @@ class FeeRate(db.Model):
     year = db.Column(db.Integer, nullable=False)
 
     # Applicability (NULL means applies to all)
-    class_id = db.Column(db.Integer, db.ForeignKey("classes.id"))
-    stream_id = db.Column(db.Integer, db.ForeignKey("streams.id"))
+    class_id = db.Column(db.Integer, db.ForeignKey("classes.id", ondelete="RESTRICT"))
+    stream_id = db.Column(db.Integer, db.ForeignKey("streams.id", ondelete="RESTRICT"))
     student_type = db.Column(db.Enum(StudentType))  # DAY/BOARDER specific rates
 
     # Rate amounts
@@ -269,6 +311,7 @@ class FeeRate(db.Model):
     __table_args__ = (
         db.UniqueConstraint("fee_item_id", "term", "year", "class_id",
                             "stream_id", "student_type", name="unique_fee_rate"),
+        db.Index("ix_fee_rates_term_year_active", "term", "year", "is_active"),
     )
 
     def __repr__(self):
@@ -314,6 +357,7 @@ class StudentFeeAssignment(db.Model):
     __table_args__ = (
         db.UniqueConstraint("student_id", "fee_item_id", "term", "year",
                             name="unique_student_fee_assignment"),
+        db.Index("ix_student_fee_assignments_term_year", "term", "year", "is_active"),
     )
 
     def __repr__(self):
@@ -352,6 +396,13 @@ class FeeAssessment(db.Model):
     fee_item = db.relationship("FeeItem")
     assessor = db.relationship("User")
 
+    __table_args__ = (
+        db.UniqueConstraint("student_id", "fee_item_id", "term", "year",
+                            name="unique_student_fee_assessment"),
+        db.Index("ix_fee_assessments_student_term_year", "student_id", "term", "year"),
+        db.Index("ix_fee_assessments_fee_item_term_year", "fee_item_id", "term", "year"),
+    )
+
     def __repr__(self):
         return f"<Assessment {self.student.admission_no} - {self.fee_item.code} T{self.term}/{self.year}>"
 
@@ -385,7 +436,16 @@ class Payment(db.Model):
     student = db.relationship("Student", backref="payments")
     processor = db.relationship("User")
     allocations = db.relationship("PaymentAllocation", back_populates="payment",
-                                  cascade="all, delete-orphan")
+                                  cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        db.Index("ix_payments_student", "student_id"),
+        db.Index("ix_payments_date_mode", "payment_date", "payment_mode"),
+        db.Index("ix_payments_created_at", "created_at"),
+        db.Index("ix_payments_receipt_number_trgm", "receipt_number",
+                 postgresql_using="gin",
+                 postgresql_ops={"receipt_number": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
 
     def __repr__(self):
         return f"<Payment {self.receipt_number} - {self.amount}>"
@@ -396,7 +456,7 @@ class PaymentAllocation(db.Model):
     __tablename__ = "payment_allocations"
 
     id = db.Column(db.Integer, primary_key=True)
-    payment_id = db.Column(db.Integer, db.ForeignKey("payments.id"), nullable=False)
+    payment_id = db.Column(db.Integer, db.ForeignKey("payments.id", ondelete="CASCADE"), nullable=False)
     assessment_id = db.Column(db.Integer, db.ForeignKey("fee_assessments.id"), nullable=False)
     amount = db.Column(db.Numeric(10, 2), nullable=False)
 
@@ -404,10 +464,26 @@ class PaymentAllocation(db.Model):
     payment = db.relationship("Payment", back_populates="allocations")
     assessment = db.relationship("FeeAssessment", backref="allocations")
 
+    __table_args__ = (
+        db.Index("ix_payment_allocations_payment", "payment_id"),
+        db.Index("ix_payment_allocations_assessment", "assessment_id"),
+    )
+
     def __repr__(self):
         return f"<Allocation {self.payment.receipt_number} -> {self.amount}>"
 
 
+class ReceiptCounter(db.Model):
+    """Single-row counter handing out receipt numbers"""
+    __tablename__ = "receipt_counters"
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_value = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<ReceiptCounter {self.last_value}>"
+
+
 # ===========================
 #  STUDENT PROMOTIONS
 # ===========================
@@ -419,10 +495,10 @@ class StudentPromotion(db.Model):
     student_id = db.Column(db.Integer, db.ForeignKey("students.id"), nullable=False)
 
     # From/To details
-    from_class_id = db.Column(db.Integer, db.ForeignKey("classes.id"))
-    from_stream_id = db.Column(db.Integer, db.ForeignKey("streams.id"))
-    to_class_id = db.Column(db.Integer, db.ForeignKey("classes.id"), nullable=False)
-    to_stream_id = db.Column(db.Integer, db.ForeignKey("streams.id"))
+    from_class_id = db.Column(db.Integer, db.ForeignKey("classes.id", ondelete="RESTRICT"))
+    from_stream_id = db.Column(db.Integer, db.ForeignKey("streams.id", ondelete="RESTRICT"))
+    to_class_id = db.Column(db.Integer, db.ForeignKey("classes.id", ondelete="RESTRICT"), nullable=False)
+    to_stream_id = db.Column(db.Integer, db.ForeignKey("streams.id", ondelete="RESTRICT"))
 
     # Promotion details
     academic_year = db.Column(db.Integer, nullable=False)
@@ -490,13 +566,197 @@ class Expense(db.Model):
     category = db.relationship("ExpenseCategory", backref="expenses")
     creator = db.relationship("User", backref="expenses_created")
 
+    __table_args__ = (
+        db.Index("ix_expenses_expense_date", "expense_date"),
+    )
+
     def __repr__(self):
         return f"<Expense {self.description[:30]}... - {self.amount}>"
 
 
+# ===========================
+#  CACHED LOOKUPS
+# ===========================
+# Other worker processes cannot invalidate this process's cache, so entries also expire
+LOOKUP_CACHE_TTL = 60
+
+_class_cache = {'rows': None, 'loaded_at': 0}
+_current_year_cache = {'row': None, 'loaded': False, 'loaded_at': 0}
+_stream_cache = {}  # class_id -> (loaded_at, [{'id', 'name'}])
+_vehicle_cache = {'rows': None, 'loaded_at': 0}
+
+
+def _column_values(obj):
+    """Plain column values of a model instance, safe to keep across sessions"""
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def _loaded_with_raiseload(obj):
+    """Whether obj was loaded under a raiseload() option, leaving its lazy relationships unusable"""
+    return any(dict(element.strategy or ()).get('lazy') in ('raise', 'raise_on_sql')
+               for option in inspect(obj).load_options for element in option.context)
+
+
+def _attach_cached(model, row):
+    """Attach a cached row to the current session without re-querying it,
+    preferring any instance the session has already loaded"""
+    obj = db.session.identity_map.get(db.session.identity_key(model, row['id']))
+    if obj is not None and _loaded_with_raiseload(obj):
+        # Hand out a clean copy rather than an instance whose relationships raise
+        db.session.expunge(obj)
+        obj = None
+    if obj is None:
+        obj = model(**row)
+        make_transient_to_detached(obj)
+        obj = db.session.merge(obj, load=False)
+    return obj
+
+
+def get_all_classes():
+    """All classes, served from a short-lived process cache that class writes invalidate"""
+    now = time.monotonic()
+    if _class_cache['rows'] is None or now - _class_cache['loaded_at'] > LOOKUP_CACHE_TTL:
+        _class_cache['rows'] = [_column_values(class_obj) for class_obj in Class.query.all()]
+        _class_cache['loaded_at'] = now
+
+    return [_attach_cached(Class, row) for row in _class_cache['rows']]
+
+
+def get_active_vehicles():
+    """Active vehicles for the student form dropdowns, cached like the class list"""
+    now = time.monotonic()
+    if _vehicle_cache['rows'] is None or now - _vehicle_cache['loaded_at'] > LOOKUP_CACHE_TTL:
+        _vehicle_cache['rows'] = [_column_values(vehicle)
+                                  for vehicle in Vehicle.query.filter_by(is_active=True).all()]
+        _vehicle_cache['loaded_at'] = now
+
+    return [_attach_cached(Vehicle, row) for row in _vehicle_cache['rows']]
+
+
+def get_current_academic_year():
+    """The current academic year (or None), cached like the class list"""
+    now = time.monotonic()
+    if not _current_year_cache['loaded'] or now - _current_year_cache['loaded_at'] > LOOKUP_CACHE_TTL:
+        current_year = AcademicYear.query.filter_by(is_current=True).first()
+        _current_year_cache['row'] = _column_values(current_year) if current_year else None
+        _current_year_cache['loaded'] = True
+        _current_year_cache['loaded_at'] = now
+
+    row = _current_year_cache['row']
+    return _attach_cached(AcademicYear, row) if row else None
+
+
+def invalidate_class_cache(mapper, connection, target):
+    """Drop the cached class list whenever a class row is written"""
+    _class_cache['rows'] = None
+
+
+_dashboard_cache = {'stats': None, 'loaded_at': 0}
+
+# Models whose writes change the dashboard counts or current year
+DASHBOARD_STATS_MODELS = ('Student', 'Class', 'Vehicle', 'AcademicYear')
+
+
+def get_dashboard_stats():
+    """Dashboard counts, served from a short-lived process cache that writes invalidate"""
+    now = time.monotonic()
+    if _dashboard_cache['stats'] is None or now - _dashboard_cache['loaded_at'] > LOOKUP_CACHE_TTL:
+        current_year = get_current_academic_year()
+        _dashboard_cache['stats'] = {
+            'total_students': Student.query.filter_by(is_active=True).count(),
+            'total_classes': Class.query.count(),
+            'total_vehicles': Vehicle.query.filter_by(is_active=True).count(),
+            'current_year': current_year.year if current_year else 'Not Set'
+        }
+        _dashboard_cache['loaded_at'] = now
+    return dict(_dashboard_cache['stats'])
+
+
+def get_stream_options(class_id):
+    """Id/name pairs of a class's streams for dropdowns, cached per class"""
+    now = time.monotonic()
+    cached = _stream_cache.get(class_id)
+    if cached is None or now - cached[0] > LOOKUP_CACHE_TTL:
+        streams = db.session.query(Stream.id, Stream.name).filter_by(class_id=class_id).all()
+        cached = (now, [{'id': stream.id, 'name': stream.name} for stream in streams])
+        _stream_cache[class_id] = cached
+    return cached[1]
+
+
+def invalidate_stream_cache(mapper, connection, target):
+    """Drop the cached stream options whenever a stream row is written"""
+    _stream_cache.clear()
+
+
+def invalidate_vehicle_cache(mapper, connection, target):
+    """Drop the cached active vehicles whenever a vehicle row is written"""
+    _vehicle_cache['rows'] = None
+
+
+def invalidate_dashboard_stats(mapper, connection, target):
+    """Drop the cached dashboard counts whenever a counted row is written"""
+    _dashboard_cache['stats'] = None
+
+
+def invalidate_current_year_cache(mapper, connection, target):
+    """Drop the cached current year whenever an academic year row is written"""
+    _current_year_cache['loaded'] = False
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Class, _event_name, invalidate_class_cache)
+    event.listen(AcademicYear, _event_name, invalidate_current_year_cache)
+    event.listen(Stream, _event_name, invalidate_stream_cache)
+    event.listen(Vehicle, _event_name, invalidate_vehicle_cache)
+    for _model in (Student, Class, Vehicle, AcademicYear):
+        event.listen(_model, _event_name, invalidate_dashboard_stats)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def invalidate_caches_on_bulk_write(context):
+    """Query.update() and Query.delete() skip the mapper events above"""
+    model_name = context.mapper.class_.__name__
+    if model_name == 'Class':
+        _class_cache['rows'] = None
+    if model_name == 'AcademicYear':
+        _current_year_cache['loaded'] = False
+    if model_name == 'Stream':
+        _stream_cache.clear()
+    if model_name == 'Vehicle':
+        _vehicle_cache['rows'] = None
+    if model_name in DASHBOARD_STATS_MODELS:
+        _dashboard_cache['stats'] = None
+
+
 # ===========================
 #  UTILITY FUNCTIONS
 # ===========================
+def next_receipt_sequence(skip=0):
+    """Take the next receipt sequence number inside the caller's transaction
+
+    The counter is bumped with a single UPDATE ... RETURNING, so concurrent payments
+    wait on the counter row instead of reading the same MAX() and colliding.
+
+    Args:
+        skip: Extra numbers to jump over, e.g. after a receipt number turned out to be taken
+    """
+    value = db.session.execute(
+        update(ReceiptCounter)
+        .where(ReceiptCounter.id == 1)
+        .values(last_value=ReceiptCounter.last_value + 1 + skip)
+        .returning(ReceiptCounter.last_value)
+    ).scalar()
+
+    if value is None:
+        # First receipt on this database: carry on from the existing payments
+        value = (db.session.query(db.func.max(Payment.id)).scalar() or 0) + 1 + skip
+        db.session.add(ReceiptCounter(id=1, last_value=value))
+        db.session.flush()
+
+    return value
+
+
 def generate_fee_assessments(term, year, class_id=None, stream_id=None, student_id=None):
     """Generate fee assessments for students based on their applicable fees"""
 
@@ -511,7 +771,8 @@ def generate_fee_assessments(term, year, class_id=None, stream_id=None, student_
         query = query.filter_by(class_id=class_id)
 
     students = query.all()
-    assessments_created = 0
+    pending = []
+    assessed_date = date.today()
 
     for student in students:
         # Get all applicable fee items for this student
@@ -533,22 +794,23 @@ def generate_fee_assessments(term, year, class_id=None, stream_id=None, student_
             amount = calculate_fee_amount(student, fee_item, rate_info)
 
             if amount > 0:
-                assessment = FeeAssessment(
-                    student_id=student.id,
-                    fee_item_id=fee_item.id,
-                    term=term,
-                    year=year,
-                    description=f"{fee_item.name} - Term {term} {year}",
-                    amount=amount,
-                    base_rate=rate_info.get('base_rate'),
-                    quantity=rate_info.get('quantity', 1)
-                )
-
-                db.session.add(assessment)
-                assessments_created += 1
+                pending.append({
+                    'student_id': student.id,
+                    'fee_item_id': fee_item.id,
+                    'term': term,
+                    'year': year,
+                    'description': f"{fee_item.name} - Term {term} {year}",
+                    'amount': amount,
+                    'base_rate': rate_info.get('base_rate'),
+                    'quantity': rate_info.get('quantity', 1),
+                    'assessed_date': assessed_date
+                })
+
+    if pending:
+        db.session.bulk_insert_mappings(FeeAssessment, pending)
 
     db.session.commit()
-    return assessments_created
+    return len(pending)
 
 
 def get_applicable_fees_for_student(student, term, year):
@@ -679,20 +941,35 @@ def calculate_fee_amount(student, fee_item, rate_info):
     base_rate = rate_info.get('base_rate', 0)
     quantity = rate_info.get('quantity', 1)
 
-    return Decimal(str(base_rate)) * Decimal(str(quantity))
+    # Numeric columns already load as Decimal; only convert ints/floats
+    if not isinstance(base_rate, Decimal):
+        base_rate = Decimal(str(base_rate))
+    if not isinstance(quantity, Decimal):
+        quantity = Decimal(str(quantity))
+
+    return base_rate * quantity
 
 
 def get_student_balance_summary(student_id):
     """Get comprehensive balance summary for a student"""
     student = Student.query.get_or_404(student_id)
 
-    # Get all assessments
+    # Allocations are summed per assessment first so the join does not repeat assessment amounts
+    allocated = db.session.query(
+        PaymentAllocation.assessment_id,
+        db.func.sum(PaymentAllocation.amount).label('paid')
+    ).group_by(PaymentAllocation.assessment_id).subquery()
+
+    # Get assessed and allocated totals per term in one query
     assessments = db.session.query(
         FeeAssessment.term,
         FeeAssessment.year,
-        db.func.sum(FeeAssessment.amount).label('total_assessed')
-    ).filter_by(student_id=student_id) \
+        db.func.sum(FeeAssessment.amount).label('total_assessed'),
+        db.func.coalesce(db.func.sum(allocated.c.paid), 0).label('total_paid')
+    ).outerjoin(allocated, allocated.c.assessment_id == FeeAssessment.id) \
+        .filter(FeeAssessment.student_id == student_id) \
         .group_by(FeeAssessment.term, FeeAssessment.year) \
+        .order_by(FeeAssessment.year, FeeAssessment.term) \
         .all()
 
     # Get all payments
@@ -705,24 +982,15 @@ def get_student_balance_summary(student_id):
 
     for assessment in assessments:
         assessed_amount = float(assessment.total_assessed)
+        allocated_payments = float(assessment.total_paid)
         total_assessed += assessed_amount
 
-        # Get payments allocated to this term
-        allocated_payments = db.session.query(db.func.sum(PaymentAllocation.amount)) \
-                                 .join(FeeAssessment) \
-                                 .filter(FeeAssessment.student_id == student_id,
-                                         FeeAssessment.term == assessment.term,
-                                         FeeAssessment.year == assessment.year) \
-                                 .scalar() or 0
-
-        balance = assessed_amount - float(allocated_payments)
-
         term_balances.append({
             'term': assessment.term,
             'year': assessment.year,
             'assessed': assessed_amount,
-            'paid': float(allocated_payments),
-            'balance': balance
+            'paid': allocated_payments,
+            'balance': assessed_amount - allocated_payments
         })
 
     return {
@@ -5,9 +5,12 @@ Populates the database with realistic Kenyan school data following the applicati
 """
 
 from flask import Flask
+from sqlalchemy import delete, insert, text
 from models import *
 from datetime import datetime, date, timedelta  # Added timedelta import
 from decimal import Decimal
+from collections import defaultdict
+from itertools import accumulate
 import random
 
 # Initialize Flask app and database
@@ -23,17 +26,18 @@ def clear_database():
     print("🗑️  Clearing existing data...")
     with app.app_context():
         # Order matters due to foreign key constraints
-        PaymentAllocation.query.delete()
-        Payment.query.delete()
-        FeeAssessmentLine.query.delete()
-        FeeAssessment.query.delete()
-        StudentService.query.delete()
-        FeeRate.query.delete()
-        Student.query.delete()
-        Stream.query.delete()
-        Class.query.delete()
-        FeeItem.query.delete()
-        db.session.commit()
+        models = [PaymentAllocation, Payment, FeeAssessmentLine, FeeAssessment, StudentService,
+                  FeeRate, Student, Stream, Class, FeeItem]
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # One statement wipes every table and resets the id sequences
+            tables = ', '.join(model.__tablename__ for model in models)
+            db.session.execute(text(f'TRUNCATE {tables} RESTART IDENTITY CASCADE'))
+        else:
+            # Full wipe, so there is nothing in the session worth synchronising
+            for model in models:
+                db.session.execute(delete(model).execution_options(synchronize_session=False))
+        db.session.flush()
         print("✅ Database cleared!")
 
 
@@ -76,7 +80,7 @@ def create_fee_items():
     for item in fee_items:
         db.session.add(item)
 
-    db.session.commit()
+    db.session.flush()
     print(f"✅ Created {len(fee_items)} fee items")
 
 
@@ -108,7 +112,7 @@ def create_classes_and_streams():
             db.session.add(stream)
             stream_count += 1
 
-    db.session.commit()
+    db.session.flush()
     print(f"✅ Created {len(classes)} classes and {stream_count} streams")
     return classes
 
@@ -140,7 +144,7 @@ def create_students(classes):
 
     all_names = [kikuyu_names, luo_names, luhya_names, kamba_names]
 
-    students = []
+    student_rows = []
     admission_counter = 1001
 
     for cls in classes:
@@ -182,7 +186,7 @@ def create_students(classes):
             # Generate parent contact (Kenyan mobile format)
             parent_contact = f"0{random.choice([7, 1])}{random.randint(10000000, 99999999)}"
 
-            student = Student(
+            student_rows.append(dict(
                 admission_no=f"SM/{admission_counter:04d}",
                 first_name=first_name,
                 last_name=last_name,
@@ -192,13 +196,14 @@ def create_students(classes):
                 parent_contact=parent_contact,
                 transport_distance_km=transport_distance,
                 meals_plan=meals_plan
-            )
-
-            db.session.add(student)
-            students.append(student)
+            ))
             admission_counter += 1
 
-    db.session.commit()
+    # One batched INSERT instead of a unit-of-work entry per student
+    db.session.bulk_insert_mappings(Student, student_rows)
+    db.session.flush()
+
+    students = Student.query.order_by(Student.id).all()
     print(f"✅ Created {len(students)} students")
     return students
 
@@ -311,7 +316,7 @@ def create_fee_rates():
                     db.session.add(rate)
                     rate_count += 1
 
-    db.session.commit()
+    db.session.flush()
     print(f"✅ Created {rate_count} fee rates")
 
 
@@ -322,7 +327,8 @@ def generate_fee_assessments(students):
     current_year = datetime.now().year
     terms = [1, 2, 3]
 
-    assessments_created = 0
+    students_by_id = {student.id: student for student in students}
+    assessment_rows = []
 
     for student in students:
         for term in terms:
@@ -330,51 +336,60 @@ def generate_fee_assessments(students):
             if random.random() < 0.05:  # 5% chance to skip
                 continue
 
-            assessment = FeeAssessment(
+            assessment_rows.append(dict(
                 student_id=student.id,
                 term=term,
                 year=current_year
-            )
-            db.session.add(assessment)
-            db.session.flush()  # Get ID
-
-            # Generate fee lines using the same logic as the app
-            fee_lines = calculate_student_fees_sample(student, term, current_year)
-
-            for fee_item_id, amount, description in fee_lines:
-                line = FeeAssessmentLine(
-                    assessment_id=assessment.id,
-                    fee_item_id=fee_item_id,
-                    amount=amount,
-                    description=description
-                )
-                db.session.add(line)
+            ))
+
+    # First pass: insert every assessment at once, getting the new ids back
+    # instead of flushing after each one
+    created = db.session.execute(
+        insert(FeeAssessment).returning(FeeAssessment.id, FeeAssessment.student_id, FeeAssessment.term),
+        assessment_rows
+    ).all() if assessment_rows else []
+
+    # Load the year's rates and fee items once rather than querying per student and term
+    fee_items = {item.id: item for item in FeeItem.query.all()}
+    rates_by_class_term = defaultdict(list)
+    for rate in FeeRate.query.filter_by(year=current_year).all():
+        rates_by_class_term[(rate.class_id, rate.term)].append(rate)
+
+    # Second pass: generate fee lines using the same logic as the app
+    line_rows = []
+    for assessment_id, student_id, term in created:
+        fee_lines = calculate_student_fees_sample(students_by_id[student_id], term,
+                                                  rates_by_class_term, fee_items)
+
+        for fee_item_id, amount, description in fee_lines:
+            line_rows.append(dict(
+                assessment_id=assessment_id,
+                fee_item_id=fee_item_id,
+                amount=amount,
+                description=description
+            ))
 
-            assessments_created += 1
+    db.session.bulk_insert_mappings(FeeAssessmentLine, line_rows)
+    db.session.flush()
+    print(f"✅ Generated {len(created)} fee assessments")
 
-    db.session.commit()
-    print(f"✅ Generated {assessments_created} fee assessments")
 
+def calculate_student_fees_sample(student, term, rates_by_class_term, fee_items):
+    """Calculate fees for a student (similar to app logic)
 
-def calculate_student_fees_sample(student, term, year):
-    """Calculate fees for a student (similar to app logic)"""
+    Rates come preloaded, keyed by (class_id, term), and fee items by id.
+    """
     fee_lines = []
 
     # Get applicable fee rates
-    rates = FeeRate.query.filter_by(
-        class_id=student.class_id,
-        term=term,
-        year=year
-    ).filter(
-        (FeeRate.stream_id == student.stream_id) |
-        (FeeRate.stream_id.is_(None))
-    ).filter(
-        (FeeRate.student_type == student.student_type) |
-        (FeeRate.student_type.is_(None))
-    ).all()
+    rates = [
+        rate for rate in rates_by_class_term.get((student.class_id, term), [])
+        if rate.stream_id in (student.stream_id, None)
+        and rate.student_type in (student.student_type, None)
+    ]
 
     for rate in rates:
-        fee_item = rate.fee_item
+        fee_item = fee_items[rate.fee_item_id]
 
         # Skip optional fees based on student settings
         if fee_item.is_optional:
@@ -404,90 +419,100 @@ def create_payments(students):
     print("💰 Creating payment records...")
 
     payment_modes = ['MPESA', 'BANK', 'CASH', 'CHEQUE']
+    # Payment mode weighted towards MPESA (very common in Kenya)
+    mode_weights = [0.6, 0.25, 0.1, 0.05]  # MPESA, BANK, CASH, CHEQUE
+    mode_cum_weights = list(accumulate(mode_weights))  # built once, not on every draw
+    # Receipt number format for each mode
+    receipt_formats = {'MPESA': 'MP{:06d}', 'BANK': 'BK{:06d}', 'CASH': 'CSH{:04d}', 'CHEQUE': 'CHQ{:04d}'}
+    today = date.today()
     receipt_counter = 1001
 
-    payments_created = 0
+    payment_rows = []
 
     for student in students:
         # Each student makes 2-5 payments randomly
         num_payments = random.randint(2, 5)
+        # Draw all of this student's payment modes at once
+        modes = random.choices(payment_modes, cum_weights=mode_cum_weights, k=num_payments)
 
-        for i in range(num_payments):
+        for mode in modes:
             # Payment amount (random between 5000-50000 KES)
             amount = random.randint(5000, 50000)
 
             # Payment date (random in the last 6 months)
             days_ago = random.randint(1, 180)
-            payment_date = date.today() - timedelta(days=days_ago)  # Fixed: use timedelta directly
-
-            # Payment mode weighted towards MPESA (very common in Kenya)
-            mode_weights = [0.6, 0.25, 0.1, 0.05]  # MPESA, BANK, CASH, CHEQUE
-            mode = random.choices(payment_modes, weights=mode_weights)[0]
+            payment_date = today - timedelta(days=days_ago)
 
             # Generate receipt number based on mode
-            if mode == 'MPESA':
-                receipt_no = f"MP{receipt_counter:06d}"
-            elif mode == 'BANK':
-                receipt_no = f"BK{receipt_counter:06d}"
-            elif mode == 'CASH':
-                receipt_no = f"CSH{receipt_counter:04d}"
-            else:  # CHEQUE
-                receipt_no = f"CHQ{receipt_counter:04d}"
+            receipt_no = receipt_formats[mode].format(receipt_counter)
 
             note = f"Payment from parent via {mode}"
 
-            payment = Payment(
+            payment_rows.append(dict(
                 student_id=student.id,
                 amount=amount,
                 mode=mode,
                 receipt_no=receipt_no,
                 note=note,
                 payment_date=payment_date
-            )
-
-            db.session.add(payment)
-            payments_created += 1
+            ))
             receipt_counter += 1
 
-    db.session.commit()
-    print(f"✅ Created {payments_created} payment records")
+    db.session.bulk_insert_mappings(Payment, payment_rows)
+    db.session.flush()
+    print(f"✅ Created {len(payment_rows)} payment records")
 
 
 def create_payment_allocations():
     """Allocate payments to fee lines (simplified version)"""
     print("🔄 Creating payment allocations...")
 
-    payments = Payment.query.all()
+    # Every student's first 3 assessment lines, fetched in one query instead of one per payment.
+    # Only the columns the allocations need are selected, so no ORM objects are built.
+    lines_by_student = defaultdict(list)
+    all_lines = db.session.query(
+        FeeAssessment.student_id, FeeAssessmentLine.id, FeeAssessmentLine.fee_item_id, FeeAssessmentLine.amount
+    ).join(FeeAssessmentLine, FeeAssessmentLine.assessment_id == FeeAssessment.id) \
+        .order_by(FeeAssessmentLine.id).all()
+    for line in all_lines:
+        student_lines = lines_by_student[line.student_id]
+        if len(student_lines) < 3:  # Allocate to first 3 lines
+            student_lines.append(line)
+
+    # Stream the payments and write allocations in batches so memory stays flat
+    payments = Payment.query.with_entities(Payment.id, Payment.student_id, Payment.amount) \
+        .execution_options(stream_results=True).yield_per(1000)
+
+    batch_size = 5000
+    allocation_rows = []
     allocations_created = 0
 
     for payment in payments:
-        # Get student's assessment lines
-        assessment_lines = db.session.query(FeeAssessmentLine) \
-            .join(FeeAssessment) \
-            .filter(FeeAssessment.student_id == payment.student_id) \
-            .limit(3).all()  # Allocate to first 3 lines
-
         remaining_amount = payment.amount
 
-        for line in assessment_lines:
+        for line in lines_by_student.get(payment.student_id, ()):
             if remaining_amount <= 0:
                 break
 
             # Allocate partial or full amount
             allocation_amount = min(remaining_amount, line.amount)
 
-            allocation = PaymentAllocation(
+            allocation_rows.append(dict(
                 payment_id=payment.id,
                 assessment_line_id=line.id,
                 fee_item_id=line.fee_item_id,
                 amount=allocation_amount
-            )
-
-            db.session.add(allocation)
+            ))
             remaining_amount -= allocation_amount
-            allocations_created += 1
 
-    db.session.commit()
+        if len(allocation_rows) >= batch_size:
+            db.session.bulk_insert_mappings(PaymentAllocation, allocation_rows)
+            allocations_created += len(allocation_rows)
+            allocation_rows = []
+
+    db.session.bulk_insert_mappings(PaymentAllocation, allocation_rows)
+    allocations_created += len(allocation_rows)
+    db.session.flush()
     print(f"✅ Created {allocations_created} payment allocations")
 
 
@@ -500,17 +525,21 @@ def main():
         # Create tables if they don't exist
         db.create_all()
 
-        # Clear existing data
-        clear_database()
-
-        # Populate data in logical order
-        create_fee_items()
-        classes = create_classes_and_streams()
-        students = create_students(classes)
-        create_fee_rates()
-        generate_fee_assessments(students)
-        create_payments(students)
-        create_payment_allocations()
+        # The whole run is one transaction: each step flushes what the next one reads,
+        # and nothing reaches the disk until the single commit at the end
+        with db.session.no_autoflush:
+            # Clear existing data
+            clear_database()
+
+            # Populate data in logical order
+            create_fee_items()
+            classes = create_classes_and_streams()
+            students = create_students(classes)
+            create_fee_rates()
+            generate_fee_assessments(students)
+            create_payments(students)
+            create_payment_allocations()
+        db.session.commit()
 
         print("\n" + "=" * 60)
         print("✅ DATABASE POPULATION COMPLETE!")
@@ -0,0 +1,178 @@
+import os
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test_fees.db'))
+os.environ.setdefault('SECRET_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+
+from app import (  # noqa: E402
+    app, init_database, generate_fee_assessments, assessment_conflict_insert, insert_fee_assessments
+)
+from models import (  # noqa: E402
+    db, Class, Student, FeeItem, FeeRate, FeeAssessment, StudentFeeAssignment, StudentType, Vehicle
+)
+
+# fee_assessments as created before unique_student_fee_assessment was added to the model
+LEGACY_FEE_ASSESSMENTS_DDL = """
+CREATE TABLE fee_assessments (
+    id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    fee_item_id INTEGER NOT NULL,
+    term INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    description VARCHAR(200),
+    amount NUMERIC(10, 2) NOT NULL,
+    base_rate NUMERIC(10, 2),
+    quantity NUMERIC(8, 2),
+    assessed_date DATE,
+    assessed_by INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(student_id) REFERENCES students (id),
+    FOREIGN KEY(fee_item_id) REFERENCES fee_items (id),
+    FOREIGN KEY(assessed_by) REFERENCES users (id)
+)
+"""
+
+
+class FeeAssessmentTestCase(unittest.TestCase):
+    """Three day students in one class with a universal uniform rate for term 1"""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        init_database()
+        self.create_schema()
+
+        form_one = Class(name='Form 1')
+        db.session.add(form_one)
+        db.session.flush()
+        for number in range(3):
+            db.session.add(Student(admission_no=f'T{number:03d}', first_name='Test', last_name=f'Student {number}',
+                                   class_id=form_one.id, student_type=StudentType.DAY))
+        self.uniform = FeeItem.query.filter_by(code='UNIFORM').one()
+        self.rate = FeeRate(fee_item_id=self.uniform.id, term=1, year=2025, amount=Decimal('1500'))
+        db.session.add(self.rate)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def create_schema(self):
+        """Adjust the schema built by init_database() before the fixtures are added"""
+
+
+class ConstrainedFeeAssessmentTableTest(FeeAssessmentTestCase):
+    """Fee generation on a schema built from the current models, using ON CONFLICT"""
+
+    def test_conflict_insert_is_used(self):
+        self.assertIsNotNone(assessment_conflict_insert())
+
+    def test_generation_and_rerun(self):
+        self.assertEqual(generate_fee_assessments(1, 2025), 3)
+        self.assertEqual(generate_fee_assessments(1, 2025), 0)
+        self.assertEqual(FeeAssessment.query.count(), 3)
+
+    def test_duplicate_rows_are_skipped(self):
+        generate_fee_assessments(1, 2025)
+        existing = FeeAssessment.query.first()
+        duplicate = {
+            'student_id': existing.student_id,
+            'fee_item_id': existing.fee_item_id,
+            'term': existing.term,
+            'year': existing.year,
+            'description': 'Duplicate',
+            'amount': Decimal('99'),
+        }
+
+        self.assertEqual(insert_fee_assessments([duplicate], assessment_conflict_insert()), 0)
+        db.session.commit()
+        self.assertEqual(FeeAssessment.query.count(), 3)
+        self.assertEqual(db.session.get(FeeAssessment, existing.id).amount, Decimal('1500'))
+
+    def test_force_regenerate_updates_assessments_in_place(self):
+        student = Student.query.filter_by(admission_no='T000').one()
+        vehicle = Vehicle(registration_number='KAA 001A')
+        db.session.add(vehicle)
+        db.session.flush()
+        student.vehicle_id = vehicle.id
+        student.transport_distance_km = Decimal('4.5')
+        transport = FeeItem.query.filter_by(code='TRANSPORT').one()
+        transport_rate = FeeRate(fee_item_id=transport.id, term=1, year=2025, rate_per_km=Decimal('100'))
+        db.session.add(transport_rate)
+        db.session.commit()
+
+        self.assertEqual(generate_fee_assessments(1, 2025), 4)
+        original_ids = {(a.student_id, a.fee_item_id): a.id for a in FeeAssessment.query.all()}
+        # A later row keeps SQLite from handing deleted ids straight back to re-inserted rows
+        db.session.add(FeeAssessment(student_id=student.id, fee_item_id=self.uniform.id, term=2, year=2025,
+                                     amount=Decimal('1500')))
+
+        self.rate.amount = Decimal('1600')
+        self.uniform.name = 'School Uniform'
+        transport_rate.rate_per_km = Decimal('120')
+        student.transport_distance_km = Decimal('5')
+        db.session.commit()
+
+        self.assertEqual(generate_fee_assessments(1, 2025, force_regenerate=True), 4)
+        assessments = FeeAssessment.query.filter_by(term=1).all()
+        self.assertEqual({(a.student_id, a.fee_item_id): a.id for a in assessments}, original_ids)
+
+        ride = FeeAssessment.query.filter_by(student_id=student.id, fee_item_id=transport.id, term=1).one()
+        self.assertEqual((ride.amount, ride.base_rate, ride.quantity), (Decimal('600'), Decimal('120'), Decimal('5')))
+        uniform = FeeAssessment.query.filter_by(student_id=student.id, fee_item_id=self.uniform.id, term=1).one()
+        self.assertEqual((uniform.amount, uniform.base_rate, uniform.quantity),
+                         (Decimal('1600'), Decimal('1600'), Decimal('1')))
+        self.assertEqual(uniform.description, 'School Uniform - Term 1 2025')
+
+    def test_force_regenerate_deletes_assessments_no_longer_charged(self):
+        student = Student.query.filter_by(admission_no='T000').one()
+        assignment = StudentFeeAssignment(student_id=student.id, fee_item_id=self.uniform.id, term=1, year=2025,
+                                          custom_amount=Decimal('1000'))
+        db.session.add(assignment)
+        db.session.commit()
+        generate_fee_assessments(1, 2025)
+
+        assignment.custom_amount = Decimal('-100')
+        db.session.commit()
+
+        self.assertEqual(generate_fee_assessments(1, 2025, force_regenerate=True), 2)
+        self.assertEqual(FeeAssessment.query.filter_by(student_id=student.id).count(), 0)
+        self.assertEqual(FeeAssessment.query.count(), 2)
+
+
+class LegacyFeeAssessmentTableTest(FeeAssessmentTestCase):
+    """Fee generation on a database whose fee_assessments table has no unique key"""
+
+    def create_schema(self):
+        db.session.execute(text("DROP TABLE fee_assessments"))
+        db.session.execute(text(LEGACY_FEE_ASSESSMENTS_DDL))
+        db.session.commit()
+
+    def test_generation_without_unique_constraint(self):
+        self.assertEqual(generate_fee_assessments(1, 2025), 3)
+        self.assertEqual(FeeAssessment.query.count(), 3)
+
+    def test_rerun_skips_existing_assessments(self):
+        generate_fee_assessments(1, 2025)
+        self.assertEqual(generate_fee_assessments(1, 2025), 0)
+        self.assertEqual(FeeAssessment.query.count(), 3)
+
+    def test_force_regenerate_replaces_assessments(self):
+        generate_fee_assessments(1, 2025)
+        self.rate.amount = Decimal('1600')
+        db.session.commit()
+
+        self.assertEqual(generate_fee_assessments(1, 2025, force_regenerate=True), 3)
+        self.assertEqual([assessment.amount for assessment in FeeAssessment.query.all()], [Decimal('1600')] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
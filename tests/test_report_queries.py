@@ -0,0 +1,153 @@
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test_fees.db'))
+os.environ.setdefault('SECRET_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.exc import InvalidRequestError  # noqa: E402
+from sqlalchemy.orm import Load, selectinload  # noqa: E402
+
+from app import app, init_database, generate_fee_assessments, strict_loading  # noqa: E402
+from models import (  # noqa: E402
+    db, AcademicYear, Class, FeeAssessment, FeeItem, FeeRate, Payment, PaymentAllocation, PaymentMode,
+    Stream, Student, StudentType, User, UserRole, Vehicle, get_all_classes
+)
+
+# Statements each report may issue, however many students it covers
+REPORT_QUERY_LIMITS = {
+    '/reports/class_summary?term=1&year=2025': 4,
+    '/reports/student_statement/1': 9,
+    '/reports/vehicle_revenue': 7,
+}
+
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements sent to the database inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+class ReportQueryCountTest(unittest.TestCase):
+    """Reports must not issue a query per student, payment or assessment"""
+
+    def setUp(self):
+        app.testing = True
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        init_database()
+
+        db.session.add(User(email='admin@example.com', name='Admin', role=UserRole.ADMIN))
+        db.session.add(AcademicYear(year=2025, start_date=date(2025, 1, 1), end_date=date(2025, 12, 31),
+                                    is_current=True))
+        classes = [Class(name='Form 1'), Class(name='Form 2')]
+        db.session.add_all(classes)
+        db.session.flush()
+        streams = [Stream(class_id=class_obj.id, name=name) for class_obj in classes for name in ('A', 'B')]
+        vehicles = [Vehicle(registration_number='KAA 001A'), Vehicle(registration_number='KBB 002B')]
+        db.session.add_all(streams + vehicles)
+        db.session.flush()
+
+        transport = FeeItem.query.filter_by(code='TRANSPORT').one()
+        uniform = FeeItem.query.filter_by(code='UNIFORM').one()
+        db.session.add_all([
+            FeeRate(fee_item_id=uniform.id, term=1, year=2025, amount=Decimal('1500')),
+            FeeRate(fee_item_id=transport.id, term=1, year=2025, rate_per_km=Decimal('100')),
+        ])
+        db.session.commit()
+        self.streams = streams
+        self.vehicles = vehicles
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['_user_id'] = '1'
+            sess['_fresh'] = True
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        app.testing = False
+
+    def add_students(self, count):
+        """Add students with assessments and a partly allocated payment each"""
+        start = Student.query.count()
+        for number in range(start, start + count):
+            stream = self.streams[number % len(self.streams)]
+            db.session.add(Student(
+                admission_no=f'R{number:03d}', first_name='Report', last_name=f'Student {number}',
+                class_id=stream.class_id, stream_id=stream.id, student_type=StudentType.DAY,
+                vehicle_id=self.vehicles[number % len(self.vehicles)].id,
+                transport_distance_km=Decimal('4.5')))
+        db.session.commit()
+        generate_fee_assessments(1, 2025)
+
+        for student in Student.query.filter(Student.admission_no >= f'R{start:03d}').all():
+            payment = Payment(student_id=student.id, amount=Decimal('1000'), payment_mode=PaymentMode.CASH,
+                              receipt_number=f'RCT{student.id:06d}', payment_date=date(2025, 2, 1))
+            db.session.add(payment)
+            db.session.flush()
+            assessment = FeeAssessment.query.filter_by(student_id=student.id).first()
+            db.session.add(PaymentAllocation(payment_id=payment.id, assessment_id=assessment.id,
+                                             amount=Decimal('1000')))
+        db.session.commit()
+
+    def report_query_counts(self):
+        counts = {}
+        for url in REPORT_QUERY_LIMITS:
+            with count_queries() as statements:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            counts[url] = len(statements)
+        return counts
+
+    def test_report_query_counts_stay_bounded(self):
+        self.add_students(3)
+        small = self.report_query_counts()
+        self.add_students(9)
+        large = self.report_query_counts()
+
+        for url, limit in REPORT_QUERY_LIMITS.items():
+            self.assertLessEqual(small[url], limit, url)
+            self.assertLessEqual(large[url], limit, url)
+
+    def test_strict_loading_only_applies_to_the_lead_entity(self):
+        self.add_students(2)
+        db.session.expunge_all()
+        student = Student.query.filter_by(id=1).options(
+            selectinload(Student.class_obj), *strict_loading(Student)).one()
+
+        with self.assertRaises(InvalidRequestError):
+            student.payments
+        self.assertEqual(len(student.class_obj.streams), 2)
+        for class_obj in get_all_classes():
+            self.assertEqual(len(class_obj.streams), 2)
+
+    def test_cached_classes_replace_raiseload_instances(self):
+        db.session.expunge_all()
+        # Keep the strict instances alive so they stay in the identity map
+        strict_classes = Class.query.options(Load(Class).raiseload('*', sql_only=True)).all()
+
+        for class_obj in get_all_classes():
+            self.assertNotIn(class_obj, strict_classes)
+            self.assertEqual(len(class_obj.streams), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()